@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Tuple
+
+from metrics import ADMISSION_QUEUED, ADMISSION_REJECTED, record_stage
+
+logger = logging.getLogger(__name__)
+
+# Per-path "max concurrent:max queued" limits for each worker process (empty = no admission control).
+# Requests beyond both are rejected with 429; queued requests that don't get a slot in time get 503.
+ADMISSION_LIMITS = os.getenv(
+    "ADMISSION_LIMITS",
+    "/ask=64:64,/ask/stream=64:64,/documents/search=32:64,/documents=8:16,/analyze-image=4:8",
+)
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000"))
+# Seconds clients are told to wait before retrying a rejected request
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+class AdmissionRejected(Exception):
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+class EndpointLimiter:
+    """Concurrency limit with a bounded wait queue for one endpoint.
+
+    At most max_concurrent requests run; up to max_queue more wait for a
+    slot for at most queue_timeout seconds. Anything beyond that is
+    rejected at once, so overload shows up as fast errors instead of
+    ever-growing latency.
+    """
+
+    def __init__(self, route: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.route = route
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    def _reject(self, status: int, reason: str):
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc(route=self.route, reason=reason)
+        raise AdmissionRejected(status, reason)
+
+    async def acquire(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+        else:
+            if self.queued >= self.max_queue:
+                self._reject(429, "queue_full")
+            self.queued += 1
+            ADMISSION_QUEUED.inc(route=self.route)
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject(503, "queue_timeout")
+            finally:
+                self.queued -= 1
+                ADMISSION_QUEUED.dec(route=self.route)
+                record_stage("admission_wait", time.perf_counter() - start)
+        self.active += 1
+        self.admitted += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Parse "/ask=64:64,/documents/search=32" into {path: (max_concurrent, max_queue)}"""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        path, _, value = entry.partition("=")
+        concurrent, _, queue = value.partition(":")
+        try:
+            limits[path.strip()] = (int(concurrent), int(queue or 0))
+        except ValueError:
+            logger.warning("Ignoring malformed ADMISSION_LIMITS entry '%s'", entry)
+    return limits
+
+def build_limiters(spec: str = ADMISSION_LIMITS, queue_timeout_ms: float = ADMISSION_QUEUE_TIMEOUT_MS) -> Dict[str, EndpointLimiter]:
+    return {path: EndpointLimiter(path, concurrent, queue, queue_timeout_ms / 1000)
+            for path, (concurrent, queue) in parse_limits(spec).items()}
+
+class AdmissionMiddleware:
+    """ASGI middleware applying per-path admission limits.
+
+    The slot is held until the response body has been sent, so streamed
+    answers count against the limit for as long as they stream.
+    """
+
+    def __init__(self, app, limiters: Dict[str, EndpointLimiter]):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiters.get(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        try:
+            await limiter.acquire()
+        except AdmissionRejected as e:
+            return await self._send_rejection(send, e)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    @staticmethod
+    async def _send_rejection(send, rejection: AdmissionRejected):
+        detail = "Too many requests queued" if rejection.status == 429 else "Server busy, no capacity freed up in time"
+        body = json.dumps({"detail": detail, "reason": rejection.reason}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": rejection.status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(ADMISSION_RETRY_AFTER).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache:
+    """Bounded cache of full answers looked up by question similarity.
+
+    An answer is reused when a new question's embedding has cosine similarity
+    >= threshold with a cached question that was answered from the same RAG
+    sources. Entries are evicted least-recently-used beyond max_entries and
+    persisted to a .npz file so the cache survives restarts.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, threshold: float = 0.95, dim: Optional[int] = None):
+        self.path = path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.lookups = 0
+        self.hits = 0
+        self.tokens_saved = 0
+        self.unsaved_changes = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._groups: Dict[Tuple[str, ...], List[int]] = {}
+        self._matrices: Dict[Tuple[str, ...], np.ndarray] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def _sources_key(sources: Sequence[str]) -> Tuple[str, ...]:
+        return tuple(sorted(sources))
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, key: Tuple[str, ...]) -> np.ndarray:
+        matrix = self._matrices.get(key)
+        if matrix is None:
+            matrix = np.stack([self._entries[entry_id]["embedding"] for entry_id in self._groups[key]])
+            self._matrices[key] = matrix
+        return matrix
+
+    def lookup(self, embedding, sources: Sequence[str]) -> Optional[str]:
+        """Return a cached answer for a similar question with the same sources"""
+        key = self._sources_key(sources)
+        vector = self._normalize(embedding)
+        with self._lock:
+            self.lookups += 1
+            if not self._groups.get(key):
+                return None
+            scores = self._matrix(key) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            entry_id = self._groups[key][best]
+            entry = self._entries[entry_id]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.tokens_saved += entry["tokens"]
+            return entry["answer"]
+
+    def store(self, embedding, sources: Sequence[str], question: str, answer: str, tokens: int):
+        if self.max_entries <= 0:
+            return
+        key = self._sources_key(sources)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "embedding": self._normalize(embedding),
+                "sources": key,
+                "question": question,
+                "answer": answer,
+                "tokens": tokens,
+                "created": time.time(),
+            }
+            self._groups.setdefault(key, []).append(entry_id)
+            self._matrices.pop(key, None)
+            while len(self._entries) > self.max_entries:
+                old_id, old_entry = self._entries.popitem(last=False)
+                self._remove_from_group(old_id, old_entry["sources"])
+            self.unsaved_changes += 1
+
+    def _remove_from_group(self, entry_id: int, key: Tuple[str, ...]):
+        group = self._groups[key]
+        group.remove(entry_id)
+        if not group:
+            del self._groups[key]
+        self._matrices.pop(key, None)
+
+    def save(self):
+        """Atomically write the cache to disk"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self.unsaved_changes = 0
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        embeddings = np.stack([entry["embedding"] for entry in entries]) if entries else np.zeros((0, 0), dtype=np.float32)
+        records = [
+            {key: (list(value) if key == "sources" else value) for key, value in entry.items() if key != "embedding"}
+            for entry in entries
+        ]
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, embeddings=embeddings, records=np.array(json.dumps(records)))
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                embeddings = data["embeddings"]
+                records = json.loads(str(data["records"]))
+        except Exception as e:
+            logger.warning("Could not load answer cache from %s: %s", self.path, e)
+            return
+        if self.dim is not None and len(embeddings) and embeddings.shape[1] != self.dim:
+            # Saved with a different embedding model; those questions can't be compared
+            logger.warning("Ignoring answer cache at %s: built with %d-dim embeddings, model has %d", self.path, embeddings.shape[1], self.dim)
+            return
+        # Entries were saved oldest first, so re-storing keeps LRU order
+        for embedding, record in list(zip(embeddings, records))[-self.max_entries:]:
+            self.store(embedding, record["sources"], record["question"], record["answer"], record["tokens"])
+        self.unsaved_changes = 0
+        logger.info("Loaded %d cached answers from %s", len(self._entries), self.path)
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "estimated_tokens_saved": self.tokens_saved,
+        }
@@ -0,0 +1,75 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+_STOP = object()
+
+class MicroBatcher:
+    """Collects items submitted concurrently and processes them in batches.
+
+    A batch is flushed when it reaches max_batch_size items or when the oldest
+    item has waited max_wait_ms, whichever comes first. process_batch receives
+    the list of items and must return one result per item, in order.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        self._queue.put(_STOP)
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            # Skip callers that were cancelled while waiting in the queue
+            pending = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            items = [item for item, _ in pending]
+            futures = [future for _, future in pending]
+            self.batches += 1
+            self.items += len(items)
+            try:
+                results = self.process_batch(items)
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
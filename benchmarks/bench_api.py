@@ -0,0 +1,289 @@
+"""
+End-to-end API benchmark against local stand-ins for OpenAI and Milvus.
+
+Starts benchmarks/fake_openai.py (configurable latency and token rate) and
+the app (uvicorn main:app) with either the in-process vector store or a
+Milvus Lite database file, seeds documents, then drives each endpoint at
+the given concurrency levels and prints a JSON report with throughput and
+p50/p95/p99 latency per endpoint. Save reports from two commits and diff
+them to spot regressions; --ref runs the app from another commit.
+
+    python benchmarks/bench_api.py --output before.json --ref HEAD~1
+    python benchmarks/bench_api.py --output after.json
+    python benchmarks/bench_api.py --store milvus-lite --concurrency 1 16 64
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ("ask", "ask_stream", "documents", "search", "analyze_image")
+FOODS = ["chicken breast", "brown rice", "spinach", "salmon", "greek yogurt", "lentils", "almonds", "broccoli",
+         "oatmeal", "eggs", "sweet potato", "tofu", "quinoa", "avocado", "banana", "cottage cheese"]
+NUTRIENTS = ["protein", "fiber", "iron", "calcium", "vitamin C", "potassium", "omega-3 fatty acids", "magnesium"]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    summary = {"requests": len(latencies) + errors, "errors": errors,
+               "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0}
+    if latencies:
+        summary.update({f"p{pct}_ms": round(percentile(latencies, pct) * 1000, 1) for pct in (50, 95, 99)})
+        summary["mean_ms"] = round(sum(latencies) / len(latencies) * 1000, 1)
+    return summary
+
+def make_document(rng: random.Random) -> str:
+    food, nutrient = rng.choice(FOODS), rng.choice(NUTRIENTS)
+    amount = rng.randint(1, 40)
+    return (f"A serving of {food} provides about {amount} grams of {nutrient}. "
+            f"{food.capitalize()} also contains {rng.choice(NUTRIENTS)} and fits a balanced diet.")
+
+def make_question(rng: random.Random) -> str:
+    return f"How much {rng.choice(NUTRIENTS)} is in {rng.choice(FOODS)}? ({rng.randrange(10 ** 6)})"
+
+def make_image(rng: random.Random, size=(1600, 1200)) -> bytes:
+    """A JPEG food label; each one differs so the image cache can't answer from an earlier request"""
+    image = Image.new("RGB", size, tuple(rng.randrange(80, 220) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + 200, y + 150), fill=tuple(rng.randrange(256) for _ in range(3)))
+    draw.rectangle((400, 300, 1200, 900), fill="white")
+    for line, text in enumerate(["Nutrition Facts", f"Calories {rng.randint(50, 600)}", f"Protein {rng.randint(1, 40)}g"]):
+        draw.text((450, 350 + line * 150), text, fill="black", font_size=80)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+def build_request(endpoint: str, rng: random.Random, rag: bool, images) -> dict:
+    if endpoint == "ask":
+        return {"method": "POST", "url": "/ask", "json": {"question": make_question(rng), "rag": rag}}
+    if endpoint == "ask_stream":
+        return {"method": "POST", "url": "/ask/stream", "json": {"question": make_question(rng), "rag": rag}}
+    if endpoint == "documents":
+        return {"method": "POST", "url": "/documents", "json": {"content": make_document(rng), "metadata": "benchmark"}}
+    if endpoint == "search":
+        return {"method": "GET", "url": "/documents/search", "params": {"query": make_question(rng), "top_k": 3}}
+    return {"method": "POST", "url": "/analyze-image", "files": {"image": ("food.jpg", rng.choice(images), "image/jpeg")}}
+
+async def send(client: httpx.AsyncClient, endpoint: str, request: dict):
+    """Send one request; returns (latency, time to first token or None)"""
+    start = time.perf_counter()
+    if endpoint != "ask_stream":
+        response = await client.request(**request)
+        response.raise_for_status()
+        return time.perf_counter() - start, None
+    first_token = None
+    async with client.stream(**request) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line == "event: token":
+                first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token
+
+async def run_endpoint(base_url: str, endpoint: str, total: int, concurrency: int, warmup: int,
+                       rng: random.Random, rag: bool, images) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        for _ in range(warmup):
+            try:
+                await send(client, endpoint, build_request(endpoint, rng, rag, images))
+            except httpx.HTTPError:
+                pass
+
+        requests = [build_request(endpoint, rng, rag, images) for _ in range(total)]
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, first_tokens = [], []
+        errors = 0
+        statuses = {}
+
+        async def one(request):
+            nonlocal errors
+            async with semaphore:
+                try:
+                    latency, first_token = await send(client, endpoint, request)
+                    latencies.append(latency)
+                    if first_token is not None:
+                        first_tokens.append(first_token)
+                except httpx.HTTPStatusError as e:
+                    errors += 1
+                    status = str(e.response.status_code)
+                    statuses[status] = statuses.get(status, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+                    statuses["transport"] = statuses.get("transport", 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(request) for request in requests))
+        elapsed = time.perf_counter() - start
+
+    result = {"endpoint": endpoint, "concurrency": concurrency, **summarize(latencies, errors, elapsed)}
+    if first_tokens:
+        result.update({f"ttft_p{pct}_ms": round(percentile(first_tokens, pct) * 1000, 1) for pct in (50, 95, 99)})
+    if statuses:
+        result["error_statuses"] = statuses
+    return result
+
+async def seed_documents(base_url: str, count: int, rng: random.Random):
+    lines = "\n".join(json.dumps({"content": make_document(rng), "metadata": f"seed-{i}"}) for i in range(count))
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        response = await client.post("/documents/bulk", content=lines, headers={"Content-Type": "application/x-ndjson"})
+        if response.status_code == 404:
+            # Older commits without bulk ingestion
+            for line in lines.splitlines():
+                (await client.post("/documents", json=json.loads(line))).raise_for_status()
+            return
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        while True:
+            job = (await client.get(f"/documents/bulk/{job_id}")).json()
+            if job["status"] in ("completed", "failed"):
+                if job["status"] == "failed":
+                    raise RuntimeError(f"Seeding documents failed: {job.get('error_samples')}")
+                return
+            await asyncio.sleep(0.2)
+
+def poll(url: str, deadline: float, process: subprocess.Popen, expect_status: int = 200) -> bool:
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if httpx.get(url, timeout=1).status_code == expect_status:
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    return False
+
+def wait_until_ready(base_url: str, app: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    # /hello exists in every version of the app; /health/ready only once warm-up was added
+    if not poll(f"{base_url}/hello", deadline, app):
+        raise RuntimeError("The app did not start; see its log output above")
+    if httpx.get(f"{base_url}/health/ready").status_code != 404 and not poll(f"{base_url}/health/ready", deadline, app):
+        raise RuntimeError(f"The app was not ready within {timeout:.0f}s")
+
+def git_commit(cwd: str) -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True, text=True)
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd, capture_output=True, text=True)
+    return result.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+def app_environment(args, scratch: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-local-stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "LOCAL_INDEX_PATH": os.path.join(scratch, "vector_index"),
+        "ANSWER_CACHE_PATH": os.path.join(scratch, "answer_cache.npz"),
+        "IMAGE_CACHE_PATH": os.path.join(scratch, "image_cache.sqlite3"),
+        "LOG_LEVEL": "WARNING",
+    })
+    if args.store == "milvus-lite":
+        env.update({"VECTOR_STORE": "milvus", "MILVUS_URI": os.path.join(scratch, "milvus.db"),
+                    "MILVUS_COLLECTION": "benchmark"})
+    else:
+        env["VECTOR_STORE"] = "local"
+    if not args.caches:
+        # Measure the full pipeline on every request rather than cache hits
+        env.update({"ANSWER_CACHE_ENABLED": "false", "IMAGE_CACHE_ENABLED": "false",
+                    "RESULT_CACHE_SIZE": "0", "EMBEDDING_CACHE_SIZE": "0"})
+    return env
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests before each run")
+    parser.add_argument("--store", choices=("local", "milvus-lite"), default="local",
+                        help="in-process vector store or a Milvus Lite database file (needs milvus-lite)")
+    parser.add_argument("--documents", type=int, default=1000, help="documents seeded before the runs")
+    parser.add_argument("--no-rag", dest="rag", action="store_false", help="send /ask requests with rag=false")
+    parser.add_argument("--caches", action="store_true", help="keep the answer, image, embedding and search caches on")
+    parser.add_argument("--llm-latency-ms", type=float, default=500)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--images", type=int, default=8, help="distinct synthetic images for /analyze-image")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ref", help="git ref to run the app from (in a temporary worktree) instead of the working tree")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--app-port", type=int, default=8040)
+    parser.add_argument("--llm-port", type=int, default=9040)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the app to become ready")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    images = [make_image(rng) for _ in range(args.images)] if "analyze_image" in args.endpoints else []
+    cwd, worktree = ROOT, None
+    if args.ref:
+        worktree = tempfile.mkdtemp(prefix="bench-api-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=ROOT, check=True, capture_output=True)
+        cwd = worktree
+    commit = git_commit(cwd)
+
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-api-data-") as scratch:
+        env = app_environment(args, scratch)
+        llm = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai.py"), "--port", str(args.llm_port),
+             "--latency-ms", str(args.llm_latency_ms), "--tokens-per-sec", str(args.tokens_per_sec)],
+            cwd=ROOT, env=env, stdout=sys.stderr,
+        )
+        # The app's own output goes to stderr so stdout carries only the JSON report
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port), "--log-level", "warning"],
+            cwd=cwd, env=env, stdout=sys.stderr,
+        )
+        try:
+            wait_until_ready(base_url, app, args.timeout)
+            if args.documents:
+                start = time.perf_counter()
+                asyncio.run(seed_documents(base_url, args.documents, rng))
+                print(f"Seeded {args.documents} documents in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    result = asyncio.run(run_endpoint(base_url, endpoint, args.requests, concurrency, args.warmup,
+                                                      rng, args.rag, images))
+                    results.append(result)
+                    print(f"{endpoint:<14} c={concurrency:<4} {result['throughput_rps']:>8.1f} req/s  "
+                          f"p50 {result.get('p50_ms', '-')}ms  p99 {result.get('p99_ms', '-')}ms  "
+                          f"errors {result['errors']}", file=sys.stderr)
+        finally:
+            app.terminate()
+            llm.terminate()
+            app.wait()
+            llm.wait()
+            if worktree:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT, check=True)
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "machine": platform.machine()},
+        "config": {key: getattr(args, key) for key in ("store", "documents", "requests", "warmup", "rag", "caches",
+                                                        "llm_latency_ms", "tokens_per_sec", "seed")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark query embedding throughput with and without micro-batching.
+
+Each of N concurrent clients encodes queries until the total is reached,
+either calling the model one query at a time or going through the shared
+MicroBatcher used by MilvusRAGService.
+
+    python benchmarks/bench_embedding_batching.py --model BAAI/bge-large-en-v1.5 --queries 512
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sentence_transformers import SentenceTransformer
+
+from batching import MicroBatcher
+
+QUERIES = [
+    "How much protein is in chicken breast?",
+    "Calories in an egg",
+    "Is oatmeal a good breakfast for weight loss?",
+    "What are the macros in salmon?",
+    "How much fiber is in an avocado?",
+    "Best sources of vitamin D",
+    "Is brown rice healthier than white rice?",
+    "How many carbs are in a banana?",
+]
+
+def run_clients(concurrency: int, total: int, encode_one):
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            encode_one(f"{QUERIES[i % len(QUERIES)]} #{i}")
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return total / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="BAAI/bge-large-en-v1.5")
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model)
+    model.encode(QUERIES)  # warm up
+
+    batcher = MicroBatcher(lambda texts: model.encode(texts).tolist(), args.batch_size, args.max_wait_ms)
+
+    print(f"model={args.model} queries={args.queries} batch_size={args.batch_size} max_wait={args.max_wait_ms}ms")
+    print(f"{'clients':>8} {'single q/s':>12} {'batched q/s':>12} {'speedup':>8} {'avg batch':>10}")
+    for concurrency in args.concurrency:
+        single = run_clients(concurrency, args.queries, lambda q: model.encode([q]))
+        batches_before, items_before = batcher.batches, batcher.items
+        batched = run_clients(concurrency, args.queries, lambda q: batcher.submit(q).result())
+        avg_batch = (batcher.items - items_before) / max(1, batcher.batches - batches_before)
+        print(f"{concurrency:>8} {single:>12.1f} {batched:>12.1f} {batched / single:>7.2f}x {avg_batch:>10.1f}")
+    batcher.close()
+
+if __name__ == "__main__":
+    main()
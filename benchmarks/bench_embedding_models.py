@@ -0,0 +1,104 @@
+"""
+Compare embedding models and inference backends on CPU.
+
+Each model/backend pair runs in its own subprocess so resident memory is
+measured in isolation. Reports load time, RSS after loading, batch encode
+throughput, single-query latency and retrieval recall@1/@5 on a fixed
+nutrition Q&A set (benchmarks/data/nutrition_qa.jsonl).
+
+    python benchmarks/bench_embedding_models.py
+    python benchmarks/bench_embedding_models.py --models bge-large bge-small --backends sentence-transformers onnx
+    python benchmarks/bench_embedding_models.py --models /path/to/model --backends onnx
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_PATH = os.path.join(ROOT, "benchmarks", "data", "nutrition_qa.jsonl")
+
+def rss_mb() -> float:
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def load_pairs():
+    with open(DATA_PATH, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r["question"] for r in records], [r["passage"] for r in records]
+
+def worker(model: str, backend: str, texts: int, batch_size: int):
+    from embeddings import load_embedding_model
+
+    start = time.perf_counter()
+    encoder = load_embedding_model(model, backend)
+    load_seconds = time.perf_counter() - start
+    questions, passages = load_pairs()
+
+    encoder.encode(passages[:batch_size], batch_size=batch_size)  # warm up
+    corpus = (passages * (texts // len(passages) + 1))[:texts]
+    start = time.perf_counter()
+    encoder.encode(corpus, batch_size=batch_size)
+    texts_per_sec = len(corpus) / (time.perf_counter() - start)
+
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        encoder.encode([question])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    # Question i should retrieve passage i
+    scores = encoder.encode(questions) @ encoder.encode(passages).T
+    ranks = (scores > scores[np.arange(len(questions)), np.arange(len(questions))][:, None]).sum(axis=1)
+    print(json.dumps({
+        "model": model,
+        "backend": backend,
+        "dim": encoder.dim,
+        "load_s": load_seconds,
+        "rss_mb": rss_mb(),
+        "texts_per_sec": texts_per_sec,
+        "query_p50_ms": latencies[len(latencies) // 2] * 1000,
+        "recall_at_1": float(np.mean(ranks < 1)),
+        "recall_at_5": float(np.mean(ranks < 5)),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", nargs="+", default=["bge-large", "bge-base", "bge-small"])
+    parser.add_argument("--backends", nargs="+", default=["sentence-transformers", "onnx"])
+    parser.add_argument("--texts", type=int, default=512, help="passages encoded for the throughput measurement")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--worker", nargs=2, metavar=("MODEL", "BACKEND"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1], args.texts, args.batch_size)
+        return
+
+    print(f"{'model':<24}{'backend':<23}{'dim':>6}{'load s':>9}{'RSS MB':>9}{'texts/s':>10}{'query p50':>11}{'R@1':>7}{'R@5':>7}")
+    for model in args.models:
+        for backend in args.backends:
+            command = [sys.executable, os.path.abspath(__file__), "--worker", model, backend,
+                       "--texts", str(args.texts), "--batch-size", str(args.batch_size)]
+            result = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode != 0 or not lines:
+                error = (result.stderr.strip().splitlines() or ["no output"])[-1]
+                print(f"{model:<24}{backend:<23} failed: {error}")
+                continue
+            r = json.loads(lines[-1])
+            print(f"{model[-23:]:<24}{backend:<23}{r['dim']:>6}{r['load_s']:>9.1f}{r['rss_mb']:>9.0f}"
+                  f"{r['texts_per_sec']:>10.1f}{r['query_p50_ms']:>9.1f}ms{r['recall_at_1']:>7.2f}{r['recall_at_5']:>7.2f}")
+
+if __name__ == "__main__":
+    main()
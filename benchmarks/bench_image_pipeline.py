@@ -0,0 +1,144 @@
+"""
+Benchmark the /analyze-image preprocessing pipeline on phone-sized photos.
+
+Compares the previous in-request path (decode twice at full resolution,
+OCR on the event loop, re-encode the full image as JPEG) with the
+process-pool pipeline (one downscaled decode, OCR in worker processes).
+Each mode runs in its own subprocess and reports images/sec plus peak RSS
+of the server process and of the largest worker.
+
+    python benchmarks/bench_image_pipeline.py --images ~/Pictures/food
+    python benchmarks/bench_image_pipeline.py --generate 40   # synthetic 12 MP photos
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from image_pipeline import IMAGE_MAX_EDGE, TESSERACT_AVAILABLE, ImagePipeline
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def generate_photos(directory: str, count: int, size=(4032, 3024)):
+    """Write smooth 12 MP JPEGs with a nutrition label, half of them EXIF-rotated"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size[1], 0:size[0]].astype(np.float32)
+    for i in range(count):
+        base = rng.uniform(60, 200, size=3)
+        pixels = np.stack([base[c] + 40 * np.sin(x / (300 + 50 * c) + i) * np.cos(y / 400) for c in range(3)], axis=-1)
+        pixels += rng.normal(0, 6, size=pixels.shape)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((800, 600, 2400, 2200), fill="white")
+        for line, text in enumerate(["Nutrition Facts", "Calories 230", "Total Fat 8g", "Protein 12g"]):
+            draw.text((900, 700 + line * 350), text, fill="black", font_size=160)
+        exif = Image.Exif()
+        exif[0x0112] = 6 if i % 2 else 1
+        image.save(os.path.join(directory, f"photo_{i:03d}.jpg"), quality=90, exif=exif.tobytes())
+
+def baseline(image_bytes: bytes) -> int:
+    """The previous analyze_food_image preprocessing, inline"""
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if TESSERACT_AVAILABLE:
+        try:
+            import pytesseract
+            pytesseract.image_to_string(image)
+        except Exception:
+            pass
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return len(base64.b64encode(buffer.getvalue()))
+
+async def pipeline(images, workers: int) -> int:
+    image_pipeline = ImagePipeline(workers=workers)
+    image_pipeline.start()
+    semaphore = asyncio.Semaphore(workers * 2)
+
+    async def one(image_bytes):
+        async with semaphore:
+            return len(base64.b64encode((await image_pipeline.process(image_bytes)).jpeg))
+
+    try:
+        return sum(await asyncio.gather(*(one(image_bytes) for image_bytes in images)))
+    finally:
+        # Wait so the workers are reaped and counted in RUSAGE_CHILDREN
+        image_pipeline.shutdown(wait=True)
+
+def peak_rss_mb() -> float:
+    # VmHWM resets on exec, unlike ru_maxrss, so it doesn't include the parent's generated photos
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def worker(mode: str, directory: str, workers: int):
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(EXTENSIONS))
+    images = [open(path, "rb").read() for path in paths]
+    start = time.perf_counter()
+    if mode == "baseline":
+        upload_bytes = sum(baseline(image_bytes) for image_bytes in images)
+    else:
+        upload_bytes = asyncio.run(pipeline(images, workers))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "mode": mode,
+        "images": len(images),
+        "images_per_sec": len(images) / elapsed,
+        "avg_upload_kb": upload_bytes / len(images) / 1024,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", help="folder of photos (.jpg, .png, .webp)")
+    parser.add_argument("--generate", type=int, default=20, help="synthetic photos to create when --images is not given")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--worker", nargs=2, metavar=("MODE", "DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1], args.workers)
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.images
+        if not directory:
+            directory = scratch
+            print(f"Generating {args.generate} synthetic 4032x3024 photos...")
+            generate_photos(directory, args.generate)
+        print(f"OCR: {'tesseract' if TESSERACT_AVAILABLE else 'unavailable (decode/resize/encode only)'}, "
+              f"max edge {IMAGE_MAX_EDGE}, {args.workers} workers")
+        print(f"{'mode':<10}{'images':>8}{'images/s':>10}{'upload KB':>11}{'peak RSS MB':>13}{'worker RSS MB':>15}")
+        for mode in ("baseline", "pipeline"):
+            command = [sys.executable, os.path.abspath(__file__), "--worker", mode, directory, "--workers", str(args.workers)]
+            result = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode != 0 or not lines:
+                print(f"{mode:<10} failed: {(result.stderr.strip().splitlines() or ['no output'])[-1]}")
+                continue
+            r = json.loads(lines[-1])
+            worker_rss = f"{r['peak_worker_rss_mb']:.0f}" if mode == "pipeline" else "-"
+            print(f"{mode:<10}{r['images']:>8}{r['images_per_sec']:>10.2f}{r['avg_upload_kb']:>11.0f}{r['peak_rss_mb']:>13.0f}{worker_rss:>15}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark bulk ingestion throughput with synthetic nutrition documents.
+
+Generates a JSONL corpus, runs it through the bulk ingestion pipeline
+(chunking, batched encode, batched insert, single flush) and optionally
+compares it with the per-document add_documents path (encode + insert +
+flush per call) on a sample. Documents go into a throwaway index in a
+temporary directory (the local store, or a Milvus Lite file), never into
+the configured collection.
+
+    python benchmarks/bench_ingestion.py --documents 100000 --baseline 500
+    python benchmarks/bench_ingestion.py --store milvus-lite --documents 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FOODS = ["chicken breast", "salmon", "egg", "oatmeal", "brown rice", "avocado", "greek yogurt",
+         "almonds", "broccoli", "sweet potato", "lentils", "tofu", "banana", "quinoa", "spinach"]
+NUTRIENTS = ["protein", "fiber", "vitamin C", "iron", "calcium", "potassium", "omega-3 fat", "magnesium"]
+
+def synthetic_document(i: int, rng: random.Random) -> dict:
+    food = rng.choice(FOODS)
+    sentences = [
+        f"A {rng.randint(50, 300)}g serving of {food} provides {rng.randint(1, 40)}g of {rng.choice(NUTRIENTS)} "
+        f"and about {rng.randint(20, 600)} calories."
+        for _ in range(rng.randint(2, 30))
+    ]
+    return {"content": " ".join(sentences), "metadata": f"synthetic_{food.replace(' ', '_')}_{i}"}
+
+def write_corpus(path: str, count: int, seed: int):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps(synthetic_document(i, rng)) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--baseline", type=int, default=0, help="Also time add_documents() one document at a time for this many docs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--store", choices=("local", "milvus-lite"), default="local")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="bench-ingestion-") as scratch:
+        run(args, scratch)
+
+def run(args, scratch: str):
+    # The store settings are read at import time, so point them at the scratch directory first
+    os.environ["LOCAL_INDEX_PATH"] = os.path.join(scratch, "vector_index")
+    if args.store == "milvus-lite":
+        os.environ.update({"VECTOR_STORE": "milvus", "MILVUS_URI": os.path.join(scratch, "milvus.db"),
+                           "MILVUS_COLLECTION": "benchmark"})
+    else:
+        os.environ["VECTOR_STORE"] = "local"
+    from ingestion import IngestionManager
+    from rag_service import get_rag_service
+
+    rag_service = get_rag_service()
+    if not rag_service:
+        sys.exit("RAG service not available")
+
+    path = os.path.join(scratch, "corpus.jsonl")
+    write_corpus(path, args.documents, args.seed)
+
+    manager = IngestionManager(rag_service)
+    job = manager.submit([(path, "jsonl", "")])
+    while job.status in ("queued", "running"):
+        time.sleep(1)
+        stats = job.to_dict()
+        print(f"  {stats['documents_processed']} docs, {stats['chunks_inserted']} chunks, {stats['docs_per_sec']} docs/sec", end="\r")
+    stats = job.to_dict()
+    print()
+    print(f"bulk: status={stats['status']} documents={stats['documents_processed']} chunks={stats['chunks_inserted']} "
+          f"elapsed={stats['elapsed_seconds']}s docs/sec={stats['docs_per_sec']} chunks/sec={stats['chunks_per_sec']}")
+
+    if args.baseline:
+        rng = random.Random(args.seed + 1)
+        docs = [synthetic_document(i, rng) for i in range(args.baseline)]
+        start = time.perf_counter()
+        for doc in docs:
+            rag_service.add_documents([doc])
+        elapsed = time.perf_counter() - start
+        print(f"per-document add_documents: documents={len(docs)} elapsed={elapsed:.2f}s docs/sec={len(docs) / elapsed:.1f}")
+
+    manager.shutdown()
+    rag_service.shutdown()
+
+if __name__ == "__main__":
+    main()
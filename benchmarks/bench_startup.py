@@ -0,0 +1,79 @@
+"""
+Measure time from process start to the first accepted request.
+
+Starts `uvicorn main:app` and polls until a request succeeds
+(time-to-first-accepted-request), then until /health/ready returns 200
+(time-to-RAG-ready). Use --ref to measure another commit, e.g. the one
+before background warm-up, in a temporary git worktree.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --ref HEAD~1
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def poll(url: str, deadline: float, expect_status: int = 200):
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == expect_status:
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    return False
+
+def measure(cwd: str, port: int, timeout: float):
+    start = time.monotonic()
+    deadline = start + timeout
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # /hello exists in every version of the app, so it works for old commits too
+        first_request = time.monotonic() - start if poll(f"http://127.0.0.1:{port}/hello", deadline) else None
+        ready = None
+        if first_request is not None:
+            has_ready = httpx.get(f"http://127.0.0.1:{port}/health/ready").status_code != 404
+            if not has_ready:
+                ready = first_request
+            elif poll(f"http://127.0.0.1:{port}/health/ready", deadline):
+                ready = time.monotonic() - start
+        return first_request, ready
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ref", help="Git ref to measure instead of the working tree")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8030)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    cwd = ROOT
+    worktree = None
+    if args.ref:
+        worktree = tempfile.mkdtemp(prefix="startup-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=ROOT, check=True, capture_output=True)
+        cwd = worktree
+    try:
+        for run in range(1, args.runs + 1):
+            first_request, ready = measure(cwd, args.port, args.timeout)
+            fmt = lambda seconds: f"{seconds:.2f}s" if seconds is not None else "timeout"
+            print(f"run {run}: first accepted request {fmt(first_request)}, RAG ready {fmt(ready)}")
+    finally:
+        if worktree:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT, check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark the local memory-mapped vector index against Milvus.
+
+Builds clustered synthetic embeddings at each size, inserts them into each
+backend and reports recall@k against exact float32 search, single-query
+p50/p99 latency and batched queries/sec.
+
+    python benchmarks/bench_vector_store.py --sizes 10000 100000 1000000 --dim 1024
+    python benchmarks/bench_vector_store.py --milvus   # also benchmark Milvus (uses MILVUS_* env vars)
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_store import LocalVectorStore, MilvusVectorStore
+
+INSERT_BATCH = 10000
+
+def make_data(size: int, dim: int, queries: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(16, size // 500), dim)).astype(np.float32)
+    data = centers[rng.integers(len(centers), size=size)] + 0.5 * rng.normal(size=(size, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    picks = rng.integers(size, size=queries)
+    query_vectors = data[picks] + 0.2 * rng.normal(size=(queries, dim)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return data, query_vectors
+
+def exact_top_k(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = data @ queries.T
+    top = np.argpartition(-scores, k - 1, axis=0)[:k]
+    return top.T
+
+def fill(store, data: np.ndarray):
+    ids = []
+    for start in range(0, len(data), INSERT_BATCH):
+        batch = data[start:start + INSERT_BATCH]
+        ids.extend(store.insert([f"doc {start + i}" for i in range(len(batch))], batch, ["bench"] * len(batch)))
+    store.flush()
+    return np.array(ids)
+
+def run(store, ids: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, batch_size: int):
+    id_to_row = {int(doc_id): row for row, doc_id in enumerate(ids)}
+    store.search(queries[:1], k)  # warm up
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = store.search(query[None, :], k)[0]
+        latencies.append(time.perf_counter() - start)
+        hits += len({id_to_row[int(hit["id"])] for hit in results} & set(expected.tolist()))
+
+    start = time.perf_counter()
+    for offset in range(0, len(queries), batch_size):
+        store.search(queries[offset:offset + batch_size], k)
+    batched_qps = len(queries) / (time.perf_counter() - start)
+
+    latencies.sort()
+    return {
+        "recall": hits / truth.size,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "batched_qps": batched_qps,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument("--milvus", action="store_true", help="Also benchmark Milvus in a temporary collection")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'backend':>16} {'vectors':>9} {'recall@' + str(args.top_k):>10} {'p50 ms':>8} {'p99 ms':>8} {'batched q/s':>12}")
+    for size in args.sizes:
+        data, queries = make_data(size, args.dim, args.queries, args.seed)
+        truth = exact_top_k(data, queries, args.top_k)
+
+        backends = [(f"local-{dtype}", dtype) for dtype in args.dtypes]
+        if args.milvus:
+            backends.append(("milvus", None))
+        for name, dtype in backends:
+            path = None
+            if dtype:
+                path = tempfile.mkdtemp(prefix="bench-index-")
+                store = LocalVectorStore(args.dim, path, dtype)
+            else:
+                store = MilvusVectorStore(args.dim, collection_name=f"bench_vectors_{size}")
+            try:
+                ids = fill(store, data)
+                stats = run(store, ids, queries, truth, args.top_k, args.batch_size)
+                print(f"{name:>16} {size:>9} {stats['recall']:>10.3f} {stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['batched_qps']:>12.1f}")
+            finally:
+                store.close()
+                if path:
+                    shutil.rmtree(path)
+                else:
+                    store.collection.drop()
+
+if __name__ == "__main__":
+    main()
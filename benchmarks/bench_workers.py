@@ -0,0 +1,250 @@
+"""
+Memory per worker and search throughput from 1 to N uvicorn workers.
+
+For each worker count, starts the app either with every worker loading its
+own embedding model ("per-worker": uvicorn main:app --workers N) or with one
+shared inference process ("shared": python serve.py --workers N), waits
+until it is ready, then drives /documents/search (caches off, so every
+request embeds its query) and reports throughput, latency percentiles,
+admission rejections and the RSS/PSS of every process by role. PSS counts
+shared pages once across processes, so total PSS is what the node pays.
+
+The in-process vector store is seeded once by a single worker and then
+only searched, since it doesn't support several writers; with
+--store milvus the MILVUS_* settings from the environment are used.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --output workers.json
+    python benchmarks/bench_workers.py --modes shared --workers 1 2 4 8 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_api import ROOT, git_commit, make_question, seed_documents, summarize, wait_until_ready
+
+MODES = ("per-worker", "shared")
+
+def read_memory(pid: int) -> dict:
+    """RSS and PSS of a process in MB (PSS splits shared pages between the processes mapping them)"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    memory[key.lower() + "_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+def process_tree(root: int) -> dict:
+    """pid -> (parent pid, command line) for root and all its descendants"""
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+        except OSError:
+            continue
+        processes[int(entry)] = (parent, cmdline)
+    tree, frontier = {}, [root]
+    while frontier:
+        pid = frontier.pop()
+        if pid in processes:
+            tree[pid] = processes[pid]
+            frontier.extend(child for child, (parent, _) in processes.items() if parent == pid)
+    return tree
+
+def classify(tree: dict) -> dict:
+    """pid -> role: supervisor, worker, inference, ocr or helper"""
+    roles = {}
+    children = {pid: [child for child, (parent, _) in tree.items() if parent == pid] for pid in tree}
+    for pid, (parent, cmdline) in sorted(tree.items()):
+        if "inference_server.py" in cmdline:
+            roles[pid] = "inference"
+        elif "resource_tracker" in cmdline:
+            roles[pid] = "helper"
+        elif roles.get(parent) == "worker":
+            # Forked OCR pool processes
+            roles[pid] = "ocr"
+        elif "spawn_main" in cmdline:
+            roles[pid] = "worker"
+        elif "uvicorn" in cmdline:
+            # A single uvicorn worker runs in the main process itself
+            spawned = any("spawn_main" in tree[child][1] for child in children[pid])
+            roles[pid] = "supervisor" if spawned else "worker"
+        else:
+            roles[pid] = "supervisor"
+    return roles
+
+def memory_report(root: int) -> dict:
+    tree = process_tree(root)
+    roles = classify(tree)
+    by_role = {}
+    for pid, role in roles.items():
+        memory = read_memory(pid)
+        entry = by_role.setdefault(role, {"processes": 0, "rss_mb": 0.0, "pss_mb": 0.0})
+        entry["processes"] += 1
+        entry["rss_mb"] = round(entry["rss_mb"] + memory.get("rss_mb", 0.0), 1)
+        entry["pss_mb"] = round(entry["pss_mb"] + memory.get("pss_mb", 0.0), 1)
+    for entry in by_role.values():
+        entry["pss_mb_per_process"] = round(entry["pss_mb"] / entry["processes"], 1)
+    return {
+        "total_rss_mb": round(sum(entry["rss_mb"] for entry in by_role.values()), 1),
+        "total_pss_mb": round(sum(entry["pss_mb"] for entry in by_role.values()), 1),
+        "by_role": by_role,
+    }
+
+def wait_for_workers(base_url: str, app: subprocess.Popen, workers: int, timeout: float):
+    """Ready once every worker answers; new connections are spread across workers by the kernel"""
+    wait_until_ready(base_url, app, timeout)
+    deadline = time.monotonic() + timeout
+    rng = random.Random(0)
+    while time.monotonic() < deadline:
+        statuses = []
+        for _ in range(max(20, 8 * workers)):
+            with httpx.Client(base_url=base_url, timeout=60) as client:
+                ready = client.get("/health/ready").status_code
+                # The first search also loads lazily initialised state in the worker
+                search = client.get("/documents/search", params={"query": make_question(rng)}).status_code
+            statuses.append(ready == 200 and search == 200)
+        if all(statuses):
+            return
+        time.sleep(1)
+    raise RuntimeError(f"Not all {workers} workers became ready within {timeout:.0f}s")
+
+async def drive_search(base_url: str, total: int, concurrency: int, rng: random.Random) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    queries = [make_question(rng) for _ in range(total)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def one(client, query):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.get("/documents/search", params={"query": query})
+                status = str(response.status_code)
+            except httpx.HTTPError:
+                status = "transport"
+            if status == "200":
+                latencies.append(time.perf_counter() - start)
+            else:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    # The kernel spreads the pooled connections over the workers
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, query) for query in queries))
+        elapsed = time.perf_counter() - start
+    result = summarize(latencies, sum(statuses.values()), elapsed)
+    if statuses:
+        result["error_statuses"] = statuses
+    return result
+
+def app_environment(args, scratch: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "LOCAL_INDEX_PATH": os.path.join(scratch, "vector_index"),
+        "EMBEDDING_SERVER_SOCKET": os.path.join(scratch, "embeddings.sock"),
+        # Every request embeds its query and searches
+        "RESULT_CACHE_SIZE": "0", "EMBEDDING_CACHE_SIZE": "0", "ANSWER_CACHE_ENABLED": "false",
+        "IMAGE_CACHE_ENABLED": "false", "OPENAI_API_KEY": "", "LOG_LEVEL": "WARNING",
+    })
+    # Same OCR pool in both modes, so the comparison is about the embedding model
+    env.setdefault("OCR_WORKERS", "1")
+    if args.store == "local":
+        env["VECTOR_STORE"] = "local"
+    return env
+
+def start_app(mode: str, workers: int, port: int, env: dict) -> subprocess.Popen:
+    if mode == "shared":
+        command = [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)]
+    else:
+        env = {key: value for key, value in env.items() if key != "EMBEDDING_SERVER_SOCKET"}
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers)]
+    # App output goes to stderr so the JSON report on stdout stays clean
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=sys.stderr, start_new_session=True)
+
+def stop_app(app: subprocess.Popen):
+    # The app runs in its own session; stop the launcher, workers and helpers together
+    os.killpg(app.pid, signal.SIGTERM)
+    try:
+        app.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(app.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    app.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000, help="search requests per configuration")
+    parser.add_argument("--documents", type=int, default=500, help="documents seeded into the index")
+    parser.add_argument("--store", choices=("local", "milvus"), default="local")
+    parser.add_argument("--port", type=int, default=8060)
+    parser.add_argument("--timeout", type=float, default=900, help="seconds to wait for the app to become ready")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-workers-") as scratch:
+        env = app_environment(args, scratch)
+        # Seed with a single worker; afterwards workers only read the index
+        app = start_app("per-worker", 1, args.port, env)
+        try:
+            wait_until_ready(base_url, app, args.timeout)
+            asyncio.run(seed_documents(base_url, args.documents, rng))
+        finally:
+            stop_app(app)
+
+        for mode in args.modes:
+            for workers in args.workers:
+                print(f"{mode}: {workers} worker(s)", file=sys.stderr)
+                app = start_app(mode, workers, args.port, env)
+                try:
+                    wait_for_workers(base_url, app, workers, args.timeout)
+                    idle = memory_report(app.pid)
+                    search = asyncio.run(drive_search(base_url, args.requests, args.concurrency, rng))
+                    results.append({"mode": mode, "workers": workers, "concurrency": args.concurrency,
+                                    "memory_idle": idle, "memory_after_load": memory_report(app.pid), "search": search})
+                finally:
+                    stop_app(app)
+
+    report = {
+        "commit": git_commit(ROOT),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {"embedding_model": os.getenv("EMBEDDING_MODEL", "bge-large"),
+                   "embedding_backend": os.getenv("EMBEDDING_BACKEND", "sentence-transformers"),
+                   "store": args.store, "documents": args.documents, "requests": args.requests},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Minimal OpenAI-compatible stub server for local benchmarks.
+
+Serves POST /v1/chat/completions with an artificial time-to-first-token
+latency and a fixed token rate, both for regular and streamed
+(stream=true) completions, so the app can be load tested without network
+access or API costs.
+
+    python benchmarks/fake_openai.py --port 9000 --latency-ms 500 --tokens-per-sec 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="Fake OpenAI")
+
+LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", "500"))
+TOKENS_PER_SEC = float(os.getenv("FAKE_OPENAI_TOKENS_PER_SEC", "0"))
+REPLY = "This is a stubbed answer about nutrition from the fake OpenAI server."
+
+def reply_tokens():
+    words = REPLY.split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+def usage(completion_tokens: int) -> dict:
+    return {"prompt_tokens": 50, "completion_tokens": completion_tokens, "total_tokens": 50 + completion_tokens}
+
+async def token_delay():
+    if TOKENS_PER_SEC > 0:
+        await asyncio.sleep(1 / TOKENS_PER_SEC)
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-3.5-turbo")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    tokens = reply_tokens()
+    await asyncio.sleep(LATENCY_MS / 1000)
+
+    if body.get("stream"):
+        async def chunks():
+            for i, token in enumerate(tokens):
+                if i:
+                    await token_delay()
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage_chunk = dict(final, choices=[], usage=usage(len(tokens)))
+                yield f"data: {json.dumps(usage_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    if TOKENS_PER_SEC > 0:
+        await asyncio.sleep((len(tokens) - 1) / TOKENS_PER_SEC)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": REPLY},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": usage(len(tokens)),
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS)
+    parser.add_argument("--tokens-per-sec", type=float, default=TOKENS_PER_SEC)
+    args = parser.parse_args()
+    LATENCY_MS = args.latency_ms
+    TOKENS_PER_SEC = args.tokens_per_sec
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
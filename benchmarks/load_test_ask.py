@@ -0,0 +1,105 @@
+"""
+Load test for POST /ask against a local stub LLM.
+
+Starts benchmarks/fake_openai.py and the app (uvicorn main:app) as
+subprocesses, fires many concurrent /ask requests and prints latency
+percentiles. With a non-blocking pipeline p99 stays close to the stub
+latency; a blocking client serializes requests and p99 grows with load.
+
+    python benchmarks/load_test_ask.py --requests 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def wait_until_up(url: str, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start in {timeout}s")
+
+async def run_load(base_url: str, total: int, concurrency: int, rag: bool):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(i: int):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    res = await client.post("/ask", json={"question": f"How much protein is in chicken breast? #{i}", "rag": rag})
+                    res.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return latencies, errors, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--llm-latency-ms", type=float, default=500)
+    parser.add_argument("--rag", action="store_true", help="Enable RAG retrieval (needs a reachable vector store)")
+    parser.add_argument("--app-port", type=int, default=8010)
+    parser.add_argument("--llm-port", type=int, default=9010)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["OPENAI_API_KEY"] = "sk-local-stub"
+    env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}/v1"
+
+    llm = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai.py"),
+         "--port", str(args.llm_port), "--latency-ms", str(args.llm_latency_ms)],
+        cwd=ROOT, env=env,
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        asyncio.run(wait_until_up(f"http://127.0.0.1:{args.llm_port}/docs"))
+        asyncio.run(wait_until_up(f"{base_url}/hello"))
+        latencies, errors, elapsed = asyncio.run(run_load(base_url, args.requests, args.concurrency, args.rag))
+    finally:
+        app.terminate()
+        llm.terminate()
+        app.wait()
+        llm.wait()
+
+    if not latencies:
+        print(f"All {errors} requests failed")
+        return
+    print(f"requests={args.requests} concurrency={args.concurrency} llm_latency={args.llm_latency_ms:.0f}ms errors={errors}")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    for pct in (50, 95, 99):
+        print(f"p{pct}: {percentile(latencies, pct) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
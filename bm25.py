@@ -0,0 +1,99 @@
+import math
+import re
+import threading
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Words plus numbers like "2.5" or "100g", so label values stay searchable
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was what which with".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """Incremental in-memory BM25 index with array-backed postings.
+
+    Each term keeps two parallel arrays: internal document numbers
+    (uint32) and term frequencies (uint16). Internal numbers map back to
+    the vector store ids, so results can be fused with dense search.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_ids = array("q")
+        self._doc_lengths = array("I")
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, doc_ids: Iterable[int], texts: Iterable[str]):
+        for doc_id, text in zip(doc_ids, texts):
+            counts: Dict[str, int] = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            with self._lock:
+                doc_number = len(self._doc_ids)
+                self._doc_ids.append(doc_id)
+                self._doc_lengths.append(len(tokens))
+                self._total_length += len(tokens)
+                for token, count in counts.items():
+                    postings = self._postings.get(token)
+                    if postings is None:
+                        postings = self._postings[token] = (array("I"), array("H"))
+                    postings[0].append(doc_number)
+                    postings[1].append(min(count, 65535))
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """Return up to limit (doc_id, score) pairs, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            total_docs = len(self._doc_ids)
+            if not terms or total_docs == 0:
+                return []
+            doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32)
+            average_length = max(1.0, self._total_length / total_docs)
+            scores = np.zeros(total_docs, dtype=np.float32)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                docs = np.frombuffer(postings[0], dtype=np.uint32)
+                tf = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+                idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                length_norm = self.k1 * (1 - self.b + self.b * doc_lengths[docs] / average_length)
+                scores[docs] += idf * tf * (self.k1 + 1) / (tf + length_norm)
+                del docs
+            del doc_lengths
+            matched = np.flatnonzero(scores)
+            if len(matched) > limit:
+                matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+            matched = matched[np.argsort(-scores[matched])]
+            return [(self._doc_ids[i], float(scores[i])) for i in matched]
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def stats(self) -> Dict:
+        postings = sum(len(docs) for docs, _ in self._postings.values())
+        return {
+            "documents": len(self._doc_ids),
+            "terms": len(self._postings),
+            "postings": postings,
+            # 4 bytes per doc number + 2 bytes per term frequency
+            "postings_bytes": postings * 6,
+        }
+
+def reciprocal_rank_fusion(rankings: Dict[str, List], limit: int, k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists with RRF: score(d) = sum over rankings of 1 / (k + rank)"""
+    scores: Dict[int, float] = {}
+    for ranked_ids in rankings.values():
+        for rank, doc_id in enumerate(ranked_ids, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
@@ -0,0 +1,228 @@
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from metrics import timed
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Candidates fetched from retrieval before filtering, reranking and packing
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "12"))
+# Hits whose cosine similarity to the question is below this are dropped (BM25-only hits have none and are kept)
+CONTEXT_MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", "0.3"))
+# Chunks sharing at least this fraction of word trigrams with a better-ranked chunk are dropped
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Hard limits on the context added to the prompt
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+CONTEXT_MAX_PASSAGES = int(os.getenv("CONTEXT_MAX_PASSAGES", "5"))
+# Longer passages are cut to this many tokens so one huge document can't take the whole budget
+CONTEXT_MAX_PASSAGE_TOKENS = int(os.getenv("CONTEXT_MAX_PASSAGE_TOKENS", "512"))
+# A passage that doesn't fit is truncated only if at least this many tokens are left for it
+CONTEXT_MIN_PASSAGE_TOKENS = int(os.getenv("CONTEXT_MIN_PASSAGE_TOKENS", "64"))
+# Optional cross-encoder reranker, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (empty = disabled)
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+# Characters of each passage the reranker scores; cross-encoders read at most ~512 tokens anyway
+RERANKER_MAX_CHARS = 2000
+
+CHAT_MODEL = "gpt-3.5-turbo"
+
+_encoding = None
+_encoding_loaded = False
+# Set while a background load runs; callers estimate token counts instead of waiting for it
+_encoding_loading = False
+_encoding_lock = threading.Lock()
+
+def _load_encoding():
+    global _encoding, _encoding_loaded
+    if TIKTOKEN_AVAILABLE:
+        try:
+            _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+        except Exception as e:
+            logger.warning("tiktoken encoding not available: %s - estimating token counts", e)
+    _encoding_loaded = True
+
+def _get_encoding():
+    # tiktoken downloads the encoding the first time it runs on a machine (with no timeout), so the app
+    # starts that in the background; outside the app it is loaded on first use
+    if not _encoding_loaded and not _encoding_loading:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                _load_encoding()
+    return _encoding
+
+def start_loading_encoding():
+    """Load the tokenizer on a daemon thread; token counts are estimated until it is ready"""
+    global _encoding_loading
+    with _encoding_lock:
+        if _encoding_loaded or _encoding_loading:
+            return
+        _encoding_loading = True
+
+    def load():
+        with _encoding_lock:
+            _load_encoding()
+
+    threading.Thread(target=load, name="tiktoken-load", daemon=True).start()
+
+def count_tokens(text: str) -> int:
+    """Tokens of text for the chat model; estimated at 4 characters per token without tiktoken"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Prompt tokens of a chat request, including the per-message formatting overhead"""
+    return sum(4 + count_tokens(message["content"]) for message in messages) + 3
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < 3:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def format_passage(doc: Dict) -> str:
+    return f"Document ({doc['metadata']}): {doc['content']}"
+
+class BuiltContext:
+    """Context text for the prompt, the documents it came from and what was dropped on the way"""
+
+    def __init__(self, text: str = "", documents: Optional[List[Dict]] = None, tokens: int = 0,
+                 candidates: int = 0, dropped: Optional[Dict[str, int]] = None, truncated: int = 0, reranked: bool = False):
+        self.text = text
+        self.documents = documents or []
+        self.tokens = tokens
+        self.candidates = candidates
+        self.dropped = dropped or {"low_score": 0, "duplicate": 0, "budget": 0}
+        self.truncated = truncated
+        self.reranked = reranked
+
+    @property
+    def sources(self) -> List[str]:
+        return [doc["metadata"] for doc in self.documents if doc.get("metadata")]
+
+class ContextBuilder:
+    """Turns over-fetched search hits into a prompt context within a token budget.
+
+    Hits below min_score cosine similarity and near-duplicates of better
+    hits are dropped, the rest are optionally reranked with a cross-encoder
+    and packed best first until max_tokens is reached. Long passages are cut
+    to max_passage_tokens, and the last one is truncated to fit when enough
+    budget is left.
+    """
+
+    def __init__(self, min_score: float = CONTEXT_MIN_SCORE, dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+                 max_tokens: int = CONTEXT_MAX_TOKENS, max_passages: int = CONTEXT_MAX_PASSAGES,
+                 max_passage_tokens: int = CONTEXT_MAX_PASSAGE_TOKENS, reranker_model: str = RERANKER_MODEL):
+        self.min_score = min_score
+        self.dedup_threshold = dedup_threshold
+        self.max_tokens = max_tokens
+        self.max_passages = max_passages
+        self.max_passage_tokens = max_passage_tokens
+        self.reranker_model = reranker_model
+        self._reranker = None
+
+    def warm_up(self):
+        """Load the cross-encoder; slow, so callers run it off the event loop"""
+        if not self.reranker_model or self._reranker is not None:
+            return
+        try:
+            from sentence_transformers import CrossEncoder
+            self._reranker = CrossEncoder(self.reranker_model)
+            logger.info("Reranker %s loaded", self.reranker_model)
+        except Exception as e:
+            logger.warning("Reranker not available: %s - using retrieval order", e)
+            self.reranker_model = ""
+
+    @staticmethod
+    def cosine_score(doc: Dict, mode: str) -> Optional[float]:
+        # Hybrid results carry the fused rank score in "score" and the cosine similarity in "vector_score"
+        if mode == "vector":
+            return doc.get("score")
+        return doc.get("vector_score")
+
+    def _filter(self, docs: List[Dict], mode: str, dropped: Dict[str, int]) -> List[Dict]:
+        kept, kept_shingles = [], []
+        for doc in docs:
+            score = self.cosine_score(doc, mode)
+            if score is not None and score < self.min_score:
+                dropped["low_score"] += 1
+                continue
+            shingles = _shingles(doc["content"])
+            if any(len(shingles & other) / max(1, min(len(shingles), len(other))) >= self.dedup_threshold
+                   for other in kept_shingles):
+                dropped["duplicate"] += 1
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _rerank(self, query: str, docs: List[Dict]) -> List[Dict]:
+        scores = self._reranker.predict([(query, doc["content"][:RERANKER_MAX_CHARS]) for doc in docs])
+        for doc, score in zip(docs, scores):
+            doc["rerank_score"] = float(score)
+        return sorted(docs, key=lambda doc: doc["rerank_score"], reverse=True)
+
+    def _pack(self, docs: List[Dict], context: BuiltContext):
+        passages = []
+        # "\n\n" between passages costs about one token each
+        budget = self.max_tokens
+        for index, doc in enumerate(docs):
+            if len(passages) >= self.max_passages:
+                context.dropped["budget"] += len(docs) - index
+                break
+            passage = format_passage(doc)
+            tokens = count_tokens(passage)
+            cut = tokens > self.max_passage_tokens
+            if cut:
+                passage = truncate_to_tokens(passage, self.max_passage_tokens)
+                tokens = count_tokens(passage)
+            tokens += 1 if passages else 0
+            if tokens > budget:
+                if budget - 1 < CONTEXT_MIN_PASSAGE_TOKENS:
+                    context.dropped["budget"] += 1
+                    continue
+                limit = budget - 1
+                passage = truncate_to_tokens(passage, limit)
+                tokens = count_tokens(passage) + (1 if passages else 0)
+                # Re-encoding a cut can merge tokens differently; trim until it really fits
+                while tokens > budget and limit > 0:
+                    limit -= tokens - budget
+                    passage = truncate_to_tokens(passage, limit)
+                    tokens = count_tokens(passage) + (1 if passages else 0)
+                cut = True
+            context.truncated += cut
+            passages.append(passage)
+            context.documents.append(doc)
+            budget -= tokens
+        context.text = "\n\n".join(passages)
+        context.tokens = count_tokens(context.text) if passages else 0
+
+    def build(self, query: str, docs: List[Dict], mode: str) -> BuiltContext:
+        """Filter, rerank and pack search hits (best first) from the given search mode into a BuiltContext"""
+        context = BuiltContext(candidates=len(docs))
+        # Copies, so rerank scores don't leak into cached search results
+        docs = self._filter([dict(doc) for doc in docs], mode, context.dropped)
+        if self._reranker is not None and len(docs) > 1:
+            with timed("rerank"):
+                docs = self._rerank(query, docs)
+            context.reranked = True
+        self._pack(docs, context)
+        return context
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+from typing import Sequence
+
+import numpy as np
+
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Embedding model and inference backend ("sentence-transformers" or "onnx")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "bge-large")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers").lower()
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", ".cache/onnx")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "true").lower() == "true"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+# Unix socket of a shared inference process (inference_server.py) serving the model to all workers
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+
+# Short names for the supported models; any other value is used as a Hugging Face id or local path
+EMBEDDING_MODELS = {
+    "bge-large": "BAAI/bge-large-en-v1.5",  # 1024 dims, 335M params
+    "bge-base": "BAAI/bge-base-en-v1.5",    # 768 dims, 109M params
+    "bge-small": "BAAI/bge-small-en-v1.5",  # 384 dims, 33M params
+}
+
+def resolve_model_name(name: str) -> str:
+    return EMBEDDING_MODELS.get(name, name)
+
+def embedding_dimension(model) -> int:
+    # Renamed in sentence-transformers 6
+    if hasattr(model, "get_embedding_dimension"):
+        return model.get_embedding_dimension()
+    return model.get_sentence_embedding_dimension()
+
+def pooling_mode(model) -> str:
+    """"cls" or "mean", read from the model's Pooling module (bge models use CLS)"""
+    pooling = model[1]
+    mode = getattr(pooling, "pooling_mode", None)
+    if isinstance(mode, str):
+        return "cls" if mode == "cls" else "mean"
+    return "cls" if getattr(pooling, "pooling_mode_cls_token", False) else "mean"
+
+class SentenceTransformerEncoder:
+    """PyTorch inference through sentence-transformers"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = embedding_dimension(self.model)
+        self.tokenizer = self.model.tokenizer
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True)
+
+class OnnxEncoder:
+    """ONNX Runtime CPU inference, optionally with int8 dynamic quantization.
+
+    The model is exported from sentence-transformers to ONNX once and cached
+    under ONNX_CACHE_DIR together with its pooling mode and tokenizer.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = ONNX_QUANTIZE, cache_dir: str = ONNX_CACHE_DIR):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed - pip install onnxruntime")
+        # The fast tokenizer class alone avoids AutoTokenizer importing torch
+        from transformers import PreTrainedTokenizerFast
+        self.model_name = model_name
+        directory = os.path.join(cache_dir, model_name.replace("/", "__"))
+        model_path = os.path.join(directory, "model_int8.onnx" if quantize else "model.onnx")
+        if not os.path.exists(model_path):
+            export_onnx_model(model_name, directory, quantize)
+        with open(os.path.join(directory, "config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.dim = config["dim"]
+        self.pooling = config["pooling"]
+        self.max_length = config["max_length"]
+        self.tokenizer = PreTrainedTokenizerFast.from_pretrained(directory)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        batches = []
+        # Sorting by length keeps padding (and wasted compute) low within each batch
+        order = np.argsort([len(text) for text in texts])
+        for start in range(0, len(texts), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            inputs = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+            # BERT-style models take token_type_ids, which some tokenizers leave out; zeros match the default
+            feed = {name: inputs[name].astype(np.int64) if name in inputs else np.zeros_like(inputs["input_ids"], dtype=np.int64)
+                    for name in self._input_names}
+            hidden = self.session.run(None, feed)[0]
+            batches.append(self._pool(hidden, inputs["attention_mask"]))
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        embeddings[order] = np.concatenate(batches)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+def export_onnx_model(model_name: str, directory: str, quantize: bool = True):
+    """Export a sentence-transformers model's transformer to ONNX (and int8)"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(directory, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    pooling = pooling_mode(model)
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(directory)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(directory, "model.onnx")
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, *args):
+            return self.inner(**dict(zip(input_names, args))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(transformer),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(directory, "model_int8.onnx"), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(directory, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "model": model_name,
+            "dim": embedding_dimension(model),
+            "pooling": pooling,
+            "max_length": model.max_seq_length,
+        }, f)
+    logger.info("Exported '%s' to ONNX at %s%s", model_name, directory, " (int8)" if quantize else "")
+
+def load_embedding_model(name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND,
+                         server_socket: str = EMBEDDING_SERVER_SOCKET):
+    """Load the configured embedding model; returns an object with encode(), dim and tokenizer.
+
+    With server_socket set, the model lives in the shared inference process
+    (inference_server.py) and only a client for it is returned.
+    """
+    if server_socket:
+        from inference_server import RemoteEncoder
+        return RemoteEncoder(server_socket)
+    model_name = resolve_model_name(name)
+    if backend == "onnx":
+        return OnnxEncoder(model_name)
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder(model_name)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (use 'sentence-transformers' or 'onnx')")
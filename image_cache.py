@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Bits set in each byte value, for Hamming distances between packed hashes
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+
+def dhash(gray, hash_size: int = 16) -> bytes:
+    """Perceptual difference hash of a grayscale PIL image (hash_size**2 bits).
+
+    Compares neighbouring pixels of a tiny thumbnail, so re-encoded, resized
+    or slightly recompressed copies of a photo hash to nearly the same bits.
+    """
+    pixels = np.asarray(gray.resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes()
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class ImageResultCache:
+    """Bounded on-disk cache of OCR text and vision analyses per image.
+
+    Entries are keyed by the SHA-256 of the normalized decoded image. When
+    there is no exact match, an entry whose perceptual hash is within
+    max_distance bits (and whose aspect ratio matches) is returned as a
+    near-duplicate candidate. Labels with the same layout but different
+    numbers hash almost alike, so a candidate is only reused once
+    confirm_near() has checked that OCR of the new image reads the same
+    text. Entries live in SQLite and are evicted least-recently-used beyond
+    max_entries.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_distance: int = 8):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.near_rejected = 0
+        self.misses = 0
+        self.analysis_hits = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "content_hash TEXT PRIMARY KEY, dhash BLOB NOT NULL, aspect REAL NOT NULL, "
+            "ocr_text TEXT, analysis TEXT, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used)")
+        self._db.commit()
+        # Perceptual hashes are scanned in memory; the matrix is rebuilt after changes
+        self._dhashes: Dict[str, tuple] = {
+            content_hash: (np.frombuffer(hash_bytes, dtype=np.uint8), aspect)
+            for content_hash, hash_bytes, aspect in self._db.execute("SELECT content_hash, dhash, aspect FROM images")
+        }
+        self._matrix = None
+        logger.info("Image cache ready at %s (%d images)", path, len(self._dhashes))
+
+    def _nearest(self, hash_bytes: bytes, aspect: float) -> Optional[str]:
+        if not self._dhashes or self.max_distance <= 0:
+            return None
+        if self._matrix is None:
+            keys = list(self._dhashes)
+            self._matrix = (keys, np.stack([self._dhashes[key][0] for key in keys]),
+                            np.array([self._dhashes[key][1] for key in keys]))
+        keys, hashes, aspects = self._matrix
+        distances = POPCOUNT[hashes ^ np.frombuffer(hash_bytes, dtype=np.uint8)].sum(axis=1)
+        # A square crop and a wide photo can share a thumbnail; require the same shape
+        distances[np.abs(aspects - aspect) > 0.02 * aspect] = np.iinfo(distances.dtype).max
+        best = int(np.argmin(distances))
+        return keys[best] if distances[best] <= self.max_distance else None
+
+    def lookup(self, content_hash: str, hash_bytes: bytes, aspect: float) -> Optional[Dict]:
+        """Return {"content_hash", "ocr_text", "analysis", "match"} for this image or a near-duplicate.
+
+        A "near" entry is only a candidate: pass it to confirm_near() before using its results.
+        """
+        with self._lock:
+            match = "exact"
+            if content_hash not in self._dhashes:
+                match = "near"
+                content_hash = self._nearest(hash_bytes, aspect)
+            if content_hash is None:
+                self.misses += 1
+                return None
+            row = self._db.execute(
+                "SELECT ocr_text, analysis FROM images WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE images SET last_used = ? WHERE content_hash = ?", (time.time(), content_hash))
+            self._db.commit()
+            if match == "exact":
+                self.exact_hits += 1
+                if row[1] is not None:
+                    self.analysis_hits += 1
+            return {"content_hash": content_hash, "ocr_text": row[0], "analysis": row[1], "match": match}
+
+    def confirm_near(self, entry: Dict, ocr_text: str) -> bool:
+        """Whether a near-duplicate's cached results may be reused: its OCR text must match the new image's"""
+        confirmed = bool(entry["ocr_text"]) and _normalize_text(entry["ocr_text"]) == _normalize_text(ocr_text)
+        with self._lock:
+            if confirmed:
+                self.near_hits += 1
+                if entry["analysis"] is not None:
+                    self.analysis_hits += 1
+            else:
+                self.near_rejected += 1
+                self.misses += 1
+        return confirmed
+
+    def store(self, content_hash: str, hash_bytes: bytes, aspect: float,
+              ocr_text: Optional[str] = None, analysis: Optional[str] = None):
+        """Insert or update an entry; fields left as None keep their cached value"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO images (content_hash, dhash, aspect, ocr_text, analysis, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (content_hash) DO UPDATE SET "
+                "ocr_text = COALESCE(excluded.ocr_text, ocr_text), "
+                "analysis = COALESCE(excluded.analysis, analysis), last_used = excluded.last_used",
+                (content_hash, hash_bytes, aspect, ocr_text, analysis, time.time()),
+            )
+            if content_hash not in self._dhashes:
+                self._dhashes[content_hash] = (np.frombuffer(hash_bytes, dtype=np.uint8), aspect)
+                self._matrix = None
+            excess = len(self._dhashes) - self.max_entries
+            if excess > 0:
+                evicted = [row[0] for row in self._db.execute(
+                    "SELECT content_hash FROM images ORDER BY last_used LIMIT ?", (excess,)
+                )]
+                self._db.executemany("DELETE FROM images WHERE content_hash = ?", [(key,) for key in evicted])
+                for key in evicted:
+                    self._dhashes.pop(key, None)
+                self.evictions += len(evicted)
+                self._matrix = None
+            self._db.commit()
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "size": len(self._dhashes),
+            "max_entries": self.max_entries,
+            "max_distance": self.max_distance,
+            "lookups": lookups,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "near_rejected": self.near_rejected,
+            "misses": self.misses,
+            "analysis_hits": self.analysis_hits,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one in-flight computation"""
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, compute: Callable[[], Awaitable]):
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.collapsed += 1
+            # Shielded so one caller disconnecting doesn't cancel the others' result
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(compute())
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict:
+        return {"calls": self.calls, "collapsed": self.collapsed, "in_flight": len(self._inflight)}
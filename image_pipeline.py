@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+from image_cache import dhash
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pytesseract
+    # pytesseract only wraps the tesseract binary; without it every OCR call fails after writing a temp file
+    TESSERACT_AVAILABLE = shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+    if not TESSERACT_AVAILABLE:
+        logger.warning("tesseract binary not found - OCR features will be limited")
+except ImportError:
+    TESSERACT_AVAILABLE = False
+    logger.warning("pytesseract not installed - OCR features will be limited")
+
+# Upload limits for /analyze-image (checked before the image is decoded)
+IMAGE_MAX_UPLOAD_BYTES = int(float(os.getenv("IMAGE_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+
+# Images are downscaled so their longest edge is at most IMAGE_MAX_EDGE before OCR and
+# the vision upload; the vision model scales the shortest side down to 768 pixels anyway
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# OCR worker processes (default: one per core) and per-image OCR timeout
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "30"))
+
+class ImageTooLargeError(ValueError):
+    """The upload exceeds the byte or pixel limits"""
+
+class InvalidImageError(ValueError):
+    """The upload could not be decoded as an image"""
+
+class ProcessedImage:
+    """A decoded, oriented and downscaled image ready for OCR and the vision API.
+
+    content_hash is the SHA-256 of the normalized pixels and dhash a
+    perceptual hash, used to find earlier results for the same photo. gray
+    holds the grayscale pixels for OCR until it has run.
+    """
+
+    def __init__(self, jpeg: bytes, width: int, height: int, original_width: int, original_height: int,
+                 content_hash: str, dhash: bytes, gray: Optional[bytes] = None, text: str = ""):
+        self.jpeg = jpeg
+        self.width = width
+        self.height = height
+        self.original_width = original_width
+        self.original_height = original_height
+        self.content_hash = content_hash
+        self.dhash = dhash
+        self.gray = gray
+        self.text = text
+
+    @property
+    def aspect(self) -> float:
+        return self.width / self.height
+
+def open_image(image_bytes: bytes, max_pixels: int = IMAGE_MAX_PIXELS) -> Image.Image:
+    """Read the image header and check the pixel limit before anything is decoded"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except UnidentifiedImageError:
+        raise InvalidImageError("File is not a supported image")
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"Image is {width}x{height} ({width * height} pixels); the limit is {max_pixels} pixels")
+    return image
+
+def downscale(image: Image.Image, max_edge: int = IMAGE_MAX_EDGE) -> Image.Image:
+    """Decode an opened image, orient it by EXIF and shrink its longest edge to max_edge"""
+    width, height = image.size
+    scale = max_edge / max(width, height)
+    if scale < 1:
+        # JPEGs can be decoded directly at 1/2, 1/4 or 1/8 scale (never below the target size),
+        # which is much faster than a full decode followed by a resize
+        image.draft("RGB", (max(1, round(width * scale)), max(1, round(height * scale))))
+    try:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    except OSError as e:
+        raise InvalidImageError(f"Could not decode image: {e}")
+    return image
+
+def extract_text(image: Image.Image) -> str:
+    """Extract text from an image using OCR"""
+    if not TESSERACT_AVAILABLE:
+        return ""
+    try:
+        return (pytesseract.image_to_string(image, timeout=OCR_TIMEOUT_SECONDS) or "").strip()
+    except Exception as e:
+        logger.warning("OCR error: %s", e)
+        return ""
+
+def _has_metadata(jpeg: bytes) -> bool:
+    """Whether a JPEG has APP1-APP15 or comment segments (EXIF with GPS, XMP, ICC, Adobe, ...) before its image data"""
+    if jpeg[:2] != b"\xff\xd8":
+        return True
+    position = 2
+    while position + 4 <= len(jpeg):
+        if jpeg[position] != 0xFF:
+            return True
+        marker = jpeg[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker == 0xDA:
+            return False
+        if 0xE1 <= marker <= 0xEF or marker == 0xFE:
+            return True
+        position += 2 + int.from_bytes(jpeg[position + 2:position + 4], "big")
+    return True
+
+def process_image(image_bytes: bytes, max_edge: int = IMAGE_MAX_EDGE, max_pixels: int = IMAGE_MAX_PIXELS,
+                  quality: int = IMAGE_JPEG_QUALITY, keep_gray: bool = True) -> ProcessedImage:
+    """Decode, hash and JPEG-encode one upload; runs in a worker process"""
+    image = open_image(image_bytes, max_pixels)
+    original_width, original_height = image.size
+    original_format = image.format
+    original_mode = image.mode
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    image = downscale(image, max_edge)
+    content_hash = hashlib.sha256(image.tobytes()).hexdigest()
+    # Tesseract works on grayscale; converting first also makes pytesseract's temporary PNG 3x smaller
+    gray = image.convert("L")
+    if (original_format == "JPEG" and original_mode == "RGB" and orientation == 1
+            and image.size == (original_width, original_height) and not _has_metadata(image_bytes)):
+        # Already a small, upright RGB JPEG without metadata: send it as is instead of re-encoding
+        jpeg = image_bytes
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        jpeg = buffer.getvalue()
+    return ProcessedImage(jpeg, image.width, image.height, original_width, original_height, content_hash,
+                          dhash(gray), gray.tobytes() if keep_gray else None)
+
+def ocr_image(gray: bytes, size) -> str:
+    """OCR grayscale pixels from process_image; runs in a worker process"""
+    return extract_text(Image.frombytes("L", size, gray))
+
+def _init_worker():
+    # One OCR per process; stop Tesseract from also spreading each image across every core
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+class ImagePipeline:
+    """Runs image decoding and OCR in a pool of worker processes.
+
+    CPU-bound work never touches the event loop or holds the GIL of the
+    server process. Call start() early, before models are loaded and worker
+    threads exist, so the forked workers stay small and don't inherit them.
+    """
+
+    def __init__(self, workers: int = OCR_WORKERS, max_edge: int = IMAGE_MAX_EDGE,
+                 max_pixels: int = IMAGE_MAX_PIXELS, quality: int = IMAGE_JPEG_QUALITY):
+        self.workers = workers
+        self.max_edge = max_edge
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = multiprocessing.get_context("fork")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker)
+        return self._executor
+
+    def start(self):
+        """Fork all worker processes now instead of on the first uploads"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_init_worker)
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), function, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool for the next request
+            self._executor = None
+            raise
+
+    async def process(self, image_bytes: bytes) -> ProcessedImage:
+        """Decode, downscale, hash and encode an upload (without OCR)"""
+        return await self._run(process_image, image_bytes, self.max_edge, self.max_pixels, self.quality, TESSERACT_AVAILABLE)
+
+    async def ocr(self, image: ProcessedImage) -> str:
+        """OCR a processed image and release its grayscale pixels"""
+        if image.gray is None:
+            return ""
+        try:
+            return await self._run(ocr_image, image.gray, (image.width, image.height))
+        finally:
+            image.gray = None
+
+    def shutdown(self, wait: bool = False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
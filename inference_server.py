@@ -0,0 +1,313 @@
+"""
+Shared embedding inference process for multi-worker deployments.
+
+Every uvicorn worker would otherwise load its own copy of the embedding
+model. Instead, one process loads it and serves all workers over a Unix
+socket; workers set EMBEDDING_SERVER_SOCKET and get a RemoteEncoder from
+load_embedding_model(). Concurrent requests from all workers are merged into
+shared model batches, and interactive requests are rejected immediately
+when more than EMBEDDING_SERVER_MAX_QUEUE texts are already waiting.
+
+    python inference_server.py --socket /tmp/vibe-embeddings.sock
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from batching import MicroBatcher
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_SERVER_SOCKET, load_embedding_model
+
+logger = logging.getLogger(__name__)
+
+# Texts waiting for the model beyond which interactive requests are rejected as busy
+EMBEDDING_SERVER_MAX_QUEUE = int(os.getenv("EMBEDDING_SERVER_MAX_QUEUE", "512"))
+# Requests merged into one model call, and how long the first one waits for company
+EMBEDDING_SERVER_BATCH_REQUESTS = int(os.getenv("EMBEDDING_SERVER_BATCH_REQUESTS", "16"))
+EMBEDDING_SERVER_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_SERVER_BATCH_WAIT_MS", "2"))
+# Larger encode calls (ingestion) are sent in slices of this many texts, which wait instead of being rejected
+EMBEDDING_SERVER_MAX_TEXTS = int(os.getenv("EMBEDDING_SERVER_MAX_TEXTS", "64"))
+EMBEDDING_SERVER_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_SERVER_TIMEOUT_SECONDS", "60"))
+# How long a worker waits for the inference process to come up before giving up
+EMBEDDING_SERVER_CONNECT_SECONDS = float(os.getenv("EMBEDDING_SERVER_CONNECT_SECONDS", "300"))
+
+# Frame: JSON header length and binary payload length, then the header and the payload
+_FRAME = struct.Struct("!II")
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+class EmbeddingServerBusy(RuntimeError):
+    """The shared inference process has too many texts queued; retry later"""
+
+def pack_frame(header: Dict, payload: bytes = b"") -> bytes:
+    data = json.dumps(header).encode("utf-8")
+    return _FRAME.pack(len(data), len(payload)) + data + payload
+
+def _unpack_sizes(prefix: bytes) -> Tuple[int, int]:
+    header_size, payload_size = _FRAME.unpack(prefix)
+    if header_size + payload_size > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {header_size + payload_size} bytes exceeds the limit")
+    return header_size, payload_size
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Dict, bytes]:
+    header_size, payload_size = _unpack_sizes(await reader.readexactly(_FRAME.size))
+    header = json.loads(await reader.readexactly(header_size))
+    return header, await reader.readexactly(payload_size) if payload_size else b""
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Inference server closed the connection")
+        received += count
+    return bytes(buffer)
+
+def recv_frame(sock: socket.socket) -> Tuple[Dict, bytes]:
+    header_size, payload_size = _unpack_sizes(_recv_exactly(sock, _FRAME.size))
+    header = json.loads(_recv_exactly(sock, header_size))
+    return header, _recv_exactly(sock, payload_size) if payload_size else b""
+
+class InferenceServer:
+    """Serves one embedding model to every HTTP worker over a Unix socket.
+
+    Each connection sends one request at a time; requests from all
+    connections go through a MicroBatcher so they share model calls.
+    Interactive requests are admitted only while fewer than max_queue texts
+    are pending, so an overloaded model answers "busy" at once instead of
+    queueing work whose callers will have timed out. Bulk slices (ingestion)
+    always wait their turn.
+    """
+
+    def __init__(self, encoder, max_queue: int = EMBEDDING_SERVER_MAX_QUEUE,
+                 batch_requests: int = EMBEDDING_SERVER_BATCH_REQUESTS, batch_wait_ms: float = EMBEDDING_SERVER_BATCH_WAIT_MS):
+        self.encoder = encoder
+        self.max_queue = max_queue
+        self.pending = 0
+        self.connections = 0
+        self.requests = 0
+        self.texts = 0
+        self.rejected = 0
+        self.started = time.time()
+        self._batcher = MicroBatcher(self._encode_batch, batch_requests, batch_wait_ms, name="inference-batcher")
+
+    def _encode_batch(self, requests: List[Tuple[List[str], int]]) -> List[np.ndarray]:
+        texts = [text for request_texts, _ in requests for text in request_texts]
+        vectors = np.asarray(self.encoder.encode(texts, batch_size=max(size for _, size in requests)), dtype=np.float32)
+        results, start = [], 0
+        for request_texts, _ in requests:
+            results.append(vectors[start:start + len(request_texts)])
+            start += len(request_texts)
+        return results
+
+    def info(self) -> Dict:
+        tokenizer = self.encoder.tokenizer
+        return {
+            "model": self.encoder.model_name,
+            "dim": self.encoder.dim,
+            "tokenizer": tokenizer.backend_tokenizer.to_str(),
+            "special_tokens": tokenizer.special_tokens_map,
+            "model_max_length": tokenizer.model_max_length,
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.encoder.model_name,
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "connections": self.connections,
+            "requests": self.requests,
+            "texts": self.texts,
+            "rejected": self.rejected,
+            "pending_texts": self.pending,
+            "max_queue": self.max_queue,
+            "batches": self._batcher.batches,
+            "average_batch_requests": round(self._batcher.average_batch_size, 2),
+        }
+
+    async def encode(self, texts: List[str], batch_size: int, bulk: bool = False) -> np.ndarray:
+        # An idle server takes any request, however large
+        if not bulk and self.pending and self.pending + len(texts) > self.max_queue:
+            self.rejected += 1
+            raise EmbeddingServerBusy(f"{self.pending} texts queued")
+        self.pending += len(texts)
+        try:
+            return await asyncio.wrap_future(self._batcher.submit((texts, batch_size)))
+        finally:
+            self.pending -= len(texts)
+            self.requests += 1
+            self.texts += len(texts)
+
+    async def _respond(self, request: Dict) -> bytes:
+        op = request.get("op")
+        try:
+            if op == "encode":
+                vectors = await self.encode(list(request["texts"]), int(request.get("batch_size", 32)), bool(request.get("bulk")))
+                return pack_frame({"ok": True, "shape": list(vectors.shape)}, vectors.tobytes())
+            if op == "info":
+                return pack_frame({"ok": True, **self.info()})
+            if op == "stats":
+                return pack_frame({"ok": True, **self.stats()})
+            return pack_frame({"ok": False, "error": f"Unknown op '{op}'"})
+        except EmbeddingServerBusy as e:
+            return pack_frame({"ok": False, "busy": True, "error": str(e)})
+        except Exception as e:
+            logger.exception("Inference request failed")
+            return pack_frame({"ok": False, "error": str(e)})
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request, _ = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                writer.write(await self._respond(request))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Dropping inference connection: %s", e)
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, path: str):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        logger.info("Serving '%s' (dim=%d) on %s", self.encoder.model_name, self.encoder.dim, path)
+        async with server:
+            await stop.wait()
+        self._batcher.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        logger.info("Inference server stopped")
+
+class RemoteEncoder:
+    """Embedding encoder backed by the shared inference process.
+
+    Same interface as the local encoders (encode(), dim, model_name and a
+    fast tokenizer for chunking, rebuilt from the server's tokenizer so
+    token offsets match). Connections are pooled, one request in flight per
+    connection, so it can be used from any number of threads.
+    """
+
+    def __init__(self, path: str, timeout: float = EMBEDDING_SERVER_TIMEOUT_SECONDS,
+                 connect_seconds: float = EMBEDDING_SERVER_CONNECT_SECONDS, max_texts: int = EMBEDDING_SERVER_MAX_TEXTS):
+        self.path = path
+        self.timeout = timeout
+        self.max_texts = max(1, max_texts)
+        self._pool: List[socket.socket] = []
+        self._lock = threading.Lock()
+        # The inference process may still be loading the model when workers start
+        info = self._request({"op": "info"}, wait_seconds=connect_seconds)[0]
+        self.model_name = info["model"]
+        self.dim = info["dim"]
+        self.tokenizer = self._build_tokenizer(info)
+
+    @staticmethod
+    def _build_tokenizer(info: Dict):
+        from tokenizers import Tokenizer
+        from transformers import PreTrainedTokenizerFast
+        return PreTrainedTokenizerFast(tokenizer_object=Tokenizer.from_str(info["tokenizer"]),
+                                       model_max_length=info["model_max_length"], **info["special_tokens"])
+
+    def _connect(self, wait_seconds: float) -> socket.socket:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"Inference server not reachable at {self.path}")
+                time.sleep(0.5)
+
+    def _request(self, header: Dict, wait_seconds: float = 0.0) -> Tuple[Dict, bytes]:
+        with self._lock:
+            sock = self._pool.pop() if self._pool else None
+        pooled = sock is not None
+        while True:
+            if sock is None:
+                sock = self._connect(wait_seconds)
+            try:
+                sock.sendall(pack_frame(header))
+                response, payload = recv_frame(sock)
+                break
+            except ConnectionError:
+                sock.close()
+                if not pooled:
+                    raise
+                # The inference process restarted since this connection was pooled, and so did the rest
+                # of the pool; drop them all and retry once on a new connection
+                self.close()
+                sock, pooled = None, False
+            except BaseException:
+                # A half-read connection can't be reused
+                sock.close()
+                raise
+        with self._lock:
+            self._pool.append(sock)
+        if response.get("busy"):
+            raise EmbeddingServerBusy(response["error"])
+        if not response.get("ok"):
+            raise RuntimeError(f"Inference server error: {response.get('error')}")
+        return response, payload
+
+    def _encode(self, texts: List[str], batch_size: int, bulk: bool) -> np.ndarray:
+        response, payload = self._request({"op": "encode", "texts": texts, "batch_size": batch_size, "bulk": bulk})
+        return np.frombuffer(payload, dtype=np.float32).reshape(response["shape"])
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if len(texts) <= self.max_texts:
+            return self._encode(texts, batch_size, bulk=False)
+        # Bulk encodes go in slices so interactive queries from other workers get model time in between
+        return np.concatenate([self._encode(texts[start:start + self.max_texts], batch_size, bulk=True)
+                               for start in range(0, len(texts), self.max_texts)])
+
+    def stats(self) -> Dict:
+        return self._request({"op": "stats"})[0]
+
+    def close(self):
+        with self._lock:
+            for sock in self._pool:
+                sock.close()
+            self._pool.clear()
+
+def main():
+    from logging_config import configure_logging
+
+    parser = argparse.ArgumentParser(description="Shared embedding inference process for uvicorn workers")
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or "/tmp/vibe-embeddings.sock")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND)
+    args = parser.parse_args()
+    configure_logging()
+    start = time.perf_counter()
+    # Loaded locally even if this process inherited EMBEDDING_SERVER_SOCKET
+    encoder = load_embedding_model(args.model, args.backend, server_socket="")
+    logger.info("Loaded '%s' (%s) in %.1fs", encoder.model_name, args.backend, time.perf_counter() - start)
+    asyncio.run(InferenceServer(encoder).serve(args.socket))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Chunking and batching settings for bulk ingestion
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+INGEST_ENCODE_BATCH_SIZE = int(os.getenv("INGEST_ENCODE_BATCH_SIZE", "64"))
+INGEST_INSERT_BATCH_SIZE = int(os.getenv("INGEST_INSERT_BATCH_SIZE", "2048"))
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "100"))
+
+# Milvus VARCHAR limit for the content field
+MAX_CONTENT_CHARS = 65535
+
+def chunk_text(text: str, tokenizer=None, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Split text into overlapping chunks of at most max_tokens tokens.
+
+    Uses the embedding model's (fast) tokenizer offsets to cut the original
+    text when available, otherwise falls back to whitespace words.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    step = max(1, max_tokens - overlap)
+
+    if tokenizer is not None:
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+        if len(offsets) <= max_tokens:
+            return [text[:MAX_CONTENT_CHARS]]
+        chunks = []
+        for start in range(0, len(offsets), step):
+            window = offsets[start:start + max_tokens]
+            chunks.append(text[window[0][0]:window[-1][1]][:MAX_CONTENT_CHARS])
+            if start + max_tokens >= len(offsets):
+                break
+        return chunks
+
+    words = text.split()
+    if len(words) <= max_tokens:
+        return [text[:MAX_CONTENT_CHARS]]
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + max_tokens])[:MAX_CONTENT_CHARS])
+        if start + max_tokens >= len(words):
+            break
+    return chunks
+
+def chunk_documents(documents: Iterable[Dict[str, str]], tokenizer=None) -> Iterator[Dict[str, str]]:
+    """Yield one document per chunk, keeping the source metadata"""
+    for doc in documents:
+        for chunk in chunk_text(doc["content"], tokenizer):
+            yield {"content": chunk, "metadata": doc.get("metadata", "")}
+
+def read_jsonl(path: str) -> Iterator[Tuple[Optional[Dict[str, str]], Optional[str]]]:
+    """Stream (document, error) pairs from a JSONL file, one line at a time"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                content = record["content"]
+                if not isinstance(content, str):
+                    raise ValueError("'content' must be a string")
+                yield {"content": content, "metadata": str(record.get("metadata", ""))}, None
+            except (ValueError, KeyError, TypeError) as e:
+                yield None, f"line {line_number}: {e}"
+
+def read_text_file(path: str, metadata: str) -> Iterator[Tuple[Optional[Dict[str, str]], Optional[str]]]:
+    """Treat a whole plain-text file as a single document"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield {"content": f.read(), "metadata": metadata}, None
+
+class IngestionJob:
+    """Progress and throughput of one bulk ingestion run"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.documents = 0
+        self.chunks = 0
+        self.errors: List[str] = []
+        self.error_count = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        elapsed = 0.0
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "documents_processed": self.documents,
+            "chunks_inserted": self.chunks,
+            "errors": self.error_count,
+            "error_samples": self.errors,
+            "elapsed_seconds": round(elapsed, 2),
+            "docs_per_sec": round(self.documents / elapsed, 1) if elapsed else 0.0,
+            "chunks_per_sec": round(self.chunks / elapsed, 1) if elapsed else 0.0,
+        }
+
+class IngestionManager:
+    """Runs bulk ingestion jobs one at a time on a background thread.
+
+    Documents are chunked, encoded in fixed-size batches and inserted in
+    large batches; the collection is flushed once at the end of each job
+    instead of after every insert.
+    """
+
+    def __init__(self, rag_service, max_jobs: int = INGEST_MAX_JOBS):
+        self.rag_service = rag_service
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+    def submit(self, sources: List[Tuple[str, str, str]]) -> IngestionJob:
+        """Queue a job over (path, kind, metadata) sources; kind is 'jsonl' or 'text'.
+
+        The job deletes the files when it finishes.
+        """
+        job = IngestionJob()
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, sources)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[IngestionJob]:
+        return list(self._jobs.values())
+
+    def _documents(self, job: IngestionJob, sources: List[Tuple[str, str, str]]) -> Iterator[Dict[str, str]]:
+        for path, kind, metadata in sources:
+            records = read_jsonl(path) if kind == "jsonl" else read_text_file(path, metadata)
+            for doc, error in records:
+                if error:
+                    job.error_count += 1
+                    if len(job.errors) < 20:
+                        job.errors.append(error)
+                    continue
+                job.documents += 1
+                yield doc
+
+    def _run(self, job: IngestionJob, sources: List[Tuple[str, str, str]]):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            batch = []
+            for chunk in chunk_documents(self._documents(job, sources), self.rag_service.tokenizer):
+                batch.append(chunk)
+                if len(batch) >= INGEST_INSERT_BATCH_SIZE:
+                    self._insert(job, batch)
+                    batch = []
+            if batch:
+                self._insert(job, batch)
+            job.status = "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.errors.append(str(e))
+            logger.error("Ingestion job %s failed: %s", job.id, e)
+        finally:
+            # One flush per job, even if it stopped part way through
+            if job.chunks:
+                self.rag_service.flush()
+            job.finished_at = time.time()
+            for path, _, _ in sources:
+                if os.path.exists(path):
+                    os.remove(path)
+        if job.status == "completed":
+            logger.info("Ingestion job %s finished: %d documents, %d chunks", job.id, job.documents, job.chunks)
+
+    def _insert(self, job: IngestionJob, batch: List[Dict[str, str]]):
+        self.rag_service.insert_documents(batch, encode_batch_size=INGEST_ENCODE_BATCH_SIZE)
+        job.chunks += len(batch)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+import sys
+import time
+
+# LOG_FORMAT=json emits one JSON object per line for log shippers; "text" is for humans
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON, including fields passed with extra={...}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with extra fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = [f"{key}={value}" for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES]
+        return f"{line} {' '.join(extras)}" if extras else line
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Send application logs to stderr; safe to call more than once"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, "_app_handler", False):
+            root.removeHandler(existing)
+    handler._app_handler = True
+    root.addHandler(handler)
+    root.setLevel(level)
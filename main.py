@@ -1,59 +1,220 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import requests
 import os
-import io
+import re
+import json
+import time
 import base64
-from PIL import Image
-try:
-    import pytesseract
-    TESSERACT_AVAILABLE = True
-except ImportError:
-    TESSERACT_AVAILABLE = False
-    print("⚠️  pytesseract not installed - OCR features will be limited")
-from openai import OpenAI
-from typing import Optional
-from rag_service import get_rag_service
+import hashlib
+import asyncio
+import logging
+import tempfile
+from collections import deque
+from contextlib import asynccontextmanager
+import httpx
+from openai import AsyncOpenAI
+from typing import List, Literal, Optional, Tuple
+from logging_config import configure_logging
 
-# Create FastAPI instance
-app = FastAPI(title="Vibe AI Assistant with RAG", version="1.0.0")
+# Configured before the app modules are imported so their startup messages are formatted too
+configure_logging()
+logger = logging.getLogger(__name__)
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+from metrics import (ADMISSION_REJECTED, CACHE_ENTRIES, CACHE_LOOKUPS, CONTEXT_PASSAGES_DROPPED, CONTEXT_TOKENS, ERRORS,
+                     FALLBACKS, HISTORY_TOKENS, PROMPT_TOKENS, REGISTRY, SESSION_MEMORY_BYTES, SESSIONS_ACTIVE,
+                     MetricsMiddleware, record_stage, timed)
+from context_builder import CONTEXT_CANDIDATES, BuiltContext, ContextBuilder, count_message_tokens, start_loading_encoding
+from rag_service import DEFAULT_SEARCH_MODE, MAX_TOP_K, SEARCH_MODES, RAGService
+from sessions import SESSION_ID_PATTERN, Session, SessionStore, history_messages, rewrite_query
+from answer_cache import SemanticAnswerCache
+from ingestion import IngestionManager, chunk_documents
+from image_cache import ImageResultCache, SingleFlight
+from image_pipeline import IMAGE_MAX_UPLOAD_BYTES, ImagePipeline, ImageTooLargeError, InvalidImageError, ProcessedImage
+from admission import ADMISSION_RETRY_AFTER, AdmissionMiddleware, build_limiters
+from inference_server import EmbeddingServerBusy
 
 # Pydantic model for request
+SearchMode = Literal["vector", "bm25", "hybrid"]
+
 class ChatRequest(BaseModel):
     question: str
     rag: bool = True
+    search_mode: Optional[SearchMode] = None
+    # Continue a conversation; turns sharing a session_id see the earlier questions and answers
+    session_id: Optional[str] = Field(None, pattern=SESSION_ID_PATTERN)
 
 class DocumentRequest(BaseModel):
     content: str
     metadata: str = ""
 
+# Connection pool settings for the shared OpenAI HTTP client
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+
 # Initialize OpenAI client (will be None if no API key)
 openai_client = None
 try:
     api_key = os.getenv("OPENAI_API_KEY")
     if api_key:
-        openai_client = OpenAI(api_key=api_key)
-        print("✅ OpenAI API key found - ChatGPT integration enabled!")
+        # A single pooled async HTTP client keeps connections alive across requests
+        # and never blocks the event loop while waiting on the API
+        openai_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+            ),
+            timeout=OPENAI_TIMEOUT_SECONDS,
+        )
+        openai_client = AsyncOpenAI(api_key=api_key, http_client=openai_http_client)
+        logger.info("OpenAI API key found - ChatGPT integration enabled")
     else:
-        print("⚠️  No OpenAI API key found - using demo responses")
+        logger.warning("No OpenAI API key found - using demo responses")
 except Exception as e:
-    print(f"⚠️  Error initializing OpenAI: {e} - using demo responses")
+    logger.warning("Error initializing OpenAI: %s - using demo responses", e)
 
-# Initialize RAG service
-rag_service = None
-try:
-    rag_service = get_rag_service()
+# Opt-in semantic cache of full answers, keyed by question similarity and RAG sources
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", ".cache/answer_cache.npz")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SAVE_EVERY = int(os.getenv("ANSWER_CACHE_SAVE_EVERY", "20"))
+
+# On-disk cache of OCR text and vision analyses per image (exact and near-duplicate photos)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", ".cache/image_cache.sqlite3")
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "10000"))
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "8"))
+
+# RAG components are warmed up in the background after the server starts accepting
+# requests; until then /ask answers without retrieval
+rag_service = None        # set once warm-up has finished successfully
+rag_warmup_service = None # service being warmed up, for readiness reporting
+rag_warmup_state = "pending"
+ingestion_manager = None
+answer_cache = None
+# Filters, reranks and packs retrieved passages into the prompt's token budget
+context_builder = ContextBuilder()
+# Multi-turn conversations, created in the lifespan (optionally persisted to SQLite)
+session_store = None
+
+# Image decoding and OCR run in worker processes, forked at startup
+image_pipeline = ImagePipeline()
+image_cache = None
+# Concurrent uploads of the same file share one analysis
+image_flights = SingleFlight()
+
+async def warm_up_rag():
+    """Load the embedding model and vector store off the event loop, then enable RAG"""
+    global rag_service, rag_warmup_service, rag_warmup_state, ingestion_manager, answer_cache
+    loop = asyncio.get_running_loop()
+    rag_warmup_state = "loading"
+    start = time.perf_counter()
+    try:
+        service = RAGService(warm_up=False)
+        rag_warmup_service = service
+        await loop.run_in_executor(None, service.warm_up)
+    except Exception as e:
+        rag_warmup_state = "failed"
+        logger.warning("RAG service not available: %s - using basic responses", e)
+        return
+    
+    # Bulk ingestion jobs run on a background thread against the RAG service
+    ingestion_manager = IngestionManager(service)
+    
+    # Initialize answer cache (reuses the RAG service's embedding model)
+    if ANSWER_CACHE_ENABLED:
+        answer_cache = await loop.run_in_executor(
+            None, SemanticAnswerCache, ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD,
+            service.embedding_dim
+        )
+        logger.info("Semantic answer cache enabled")
+    
+    await loop.run_in_executor(None, context_builder.warm_up)
+    
+    rag_service = service
+    rag_warmup_state = "ready"
+    logger.info("RAG service initialized in %.1fs - hybrid vector + keyword search enabled", time.perf_counter() - start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global image_cache, session_store
+    # Fork OCR workers before warm-up loads the embedding model and starts threads
+    image_pipeline.start()
+    session_store = SessionStore()
+    if IMAGE_CACHE_ENABLED:
+        try:
+            image_cache = ImageResultCache(IMAGE_CACHE_PATH, IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_MAX_DISTANCE)
+        except Exception as e:
+            logger.warning("Image cache not available: %s", e)
+    # Token counting runs on the event loop for every request (history, prompt budget), with or without RAG.
+    # The encoding may have to be downloaded, so it loads in the background and counts are estimated meanwhile.
+    start_loading_encoding()
+    warmup_task = asyncio.create_task(warm_up_rag())
+    yield
+    # Release pooled connections and executor threads on shutdown
+    warmup_task.cancel()
+    if openai_client:
+        await openai_client.close()
+    image_pipeline.shutdown()
+    if image_cache:
+        image_cache.close()
+    if session_store:
+        session_store.close()
+    if answer_cache:
+        answer_cache.save()
+    if ingestion_manager:
+        ingestion_manager.shutdown()
     if rag_service:
-        print("✅ Simple RAG service initialized - Keyword-based search enabled!")
-    else:
-        print("⚠️  RAG service not available - using basic responses")
-except Exception as e:
-    print(f"⚠️  Error initializing RAG service: {e} - using basic responses")
+        rag_service.shutdown()
+
+# Create FastAPI instance
+app = FastAPI(title="Vibe AI Assistant with RAG", version="1.0.0", lifespan=lifespan)
+
+# Mount static files
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe with the warm-up state of each component.
+
+    Returns 503 while RAG is still warming up. Once warm-up has finished the
+    app is ready, even if RAG failed and requests are served without it.
+    """
+    components = {
+        "openai": {"state": "ready" if openai_client else "disabled"},
+        "rag": {"state": rag_warmup_state},
+    }
+    if rag_warmup_service:
+        components.update(rag_warmup_service.components)
+    ready = rag_warmup_state in ("ready", "failed")
+    body = {"ready": ready, "degraded": rag_warmup_state != "ready", "components": components}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Request, stage latency, error, fallback and cache metrics in the Prometheus text format"""
+    # Cache sizes are read at scrape time rather than tracked on every change
+    if rag_service:
+        caches = rag_service.cache_stats()
+        CACHE_ENTRIES.set(caches["embedding"]["size"], cache="embeddings")
+        CACHE_ENTRIES.set(caches["results"]["size"], cache="search_results")
+    if answer_cache:
+        CACHE_ENTRIES.set(answer_cache.stats()["size"], cache="answers")
+    if image_cache:
+        CACHE_ENTRIES.set(image_cache.stats()["size"], cache="images")
+    if session_store:
+        stats = session_store.stats()
+        SESSIONS_ACTIVE.set(stats["sessions"])
+        SESSION_MEMORY_BYTES.set(stats["memory_bytes"])
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -89,71 +250,329 @@ def get_demo_response(user_message: str) -> str:
     else:
         return f"I understand you're asking about: '{user_message}'. This is a demo response. To get more detailed nutrition information, please set your OPENAI_API_KEY environment variable for full ChatGPT integration."
 
-async def get_chatgpt_response(user_message: str, context: str = "") -> str:
-    """Get response from ChatGPT API with optional RAG context"""
+def build_chat_messages(user_message: str, context: str = "", history: Optional[List[dict]] = None) -> list:
+    """Build the ChatGPT message list with optional RAG context and conversation history"""
+    # Prepare system message with context if available
+    system_content = "You are NutriVibe, a helpful AI nutrition assistant. You specialize in nutrition, healthy eating, meal planning, and providing accurate nutritional information. Be friendly, informative, and provide helpful responses about food, nutrition, and health. Always provide practical, evidence-based advice."
+    
+    if context:
+        system_content += f"\n\nUse the following context to provide more accurate and detailed answers:\n{context}"
+    
+    return [
+        {
+            "role": "system",
+            "content": system_content
+        },
+        *(history or []),
+        {
+            "role": "user",
+            "content": user_message
+        }
+    ]
+
+async def stream_text(text: str):
+    """Yield a complete answer word by word to mimic token streaming"""
+    for word in re.split(r"(\s+)", text):
+        if word:
+            yield word
+
+async def get_chatgpt_response(user_message: str, context: str = "", history: Optional[List[dict]] = None) -> Tuple[str, int]:
+    """Get response from ChatGPT API with optional RAG context, plus total tokens used (0 on error)"""
     if not openai_client:
-        return "OpenAI client not initialized"
+        return "OpenAI client not initialized", 0
     
     try:
-        # Prepare system message with context if available
-        system_content = "You are NutriVibe, a helpful AI nutrition assistant. You specialize in nutrition, healthy eating, meal planning, and providing accurate nutritional information. Be friendly, informative, and provide helpful responses about food, nutrition, and health. Always provide practical, evidence-based advice."
-        
-        if context:
-            system_content += f"\n\nUse the following context to provide more accurate and detailed answers:\n{context}"
-        
-        response = openai_client.chat.completions.create(
+        with timed("llm"):
+            response = await openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=build_chat_messages(user_message, context, history),
+                max_tokens=800,
+                temperature=0.7
+            )
+        content = response.choices[0].message.content
+        if not content:
+            return "No response from ChatGPT", 0
+        return content, response.usage.total_tokens if response.usage else 0
+    except Exception as e:
+        logger.error("Error calling ChatGPT API: %s", e)
+        return f"Sorry, I encountered an error while connecting to ChatGPT: {str(e)}", 0
+
+async def stream_chatgpt_response(user_message: str, context: str = "", usage: Optional[dict] = None,
+                                  history: Optional[List[dict]] = None):
+    """Yield ChatGPT response tokens as they arrive, recording total tokens in usage"""
+    if not openai_client:
+        yield "OpenAI client not initialized"
+        return
+    
+    try:
+        stream = await openai_client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_content
-                },
-                {
-                    "role": "user",
-                    "content": user_message
-                }
-            ],
+            messages=build_chat_messages(user_message, context, history),
             max_tokens=800,
-            temperature=0.7
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        content = response.choices[0].message.content
-        return content if content else "No response from ChatGPT"
+        async for chunk in stream:
+            if chunk.usage and usage is not None:
+                usage["total_tokens"] = chunk.usage.total_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     except Exception as e:
-        print(f"Error calling ChatGPT API: {e}")
-        return f"Sorry, I encountered an error while connecting to ChatGPT: {str(e)}"
+        ERRORS.inc(stage="llm_stream")
+        logger.error("Error streaming from ChatGPT API: %s", e)
+        yield f"Sorry, I encountered an error while connecting to ChatGPT: {str(e)}"
+
+async def retrieve_context(user_message: str, use_rag: bool, search_mode: Optional[str] = None) -> BuiltContext:
+    """Look up RAG context for a question, packed into the context token budget"""
+    context = BuiltContext()
+    
+    # Only use RAG if enabled and service is available
+    if use_rag and not rag_service:
+        FALLBACKS.inc(kind="rag_unavailable")
+    if use_rag and rag_service:
+        try:
+            # Over-fetch; the context builder drops weak and duplicate hits and packs the rest
+            # Modes turned off for shared workers fall back to the default
+            mode = search_mode if search_mode in SEARCH_MODES else DEFAULT_SEARCH_MODE
+            similar_docs, timings = await rag_service.asearch_with_timings(user_message, top_k=CONTEXT_CANDIDATES, mode=mode)
+            loop = asyncio.get_running_loop()
+            with timed("context_assembly"):
+                context = await loop.run_in_executor(None, context_builder.build, user_message, similar_docs, mode)
+            for reason, count in context.dropped.items():
+                if count:
+                    CONTEXT_PASSAGES_DROPPED.inc(count, reason=reason)
+            if context.text:
+                CONTEXT_TOKENS.observe(context.tokens)
+                logger.debug("Found relevant context in %.1fms", timings["total_ms"],
+                             extra={"query": user_message[:50], "candidates": context.candidates,
+                                    "passages": len(context.documents), "context_tokens": context.tokens})
+        except Exception as e:
+            ERRORS.inc(stage="retrieval")
+            logger.warning("Error retrieving context: %s", e)
+    
+    return context
+
+def prompt_token_count(user_message: str, context: str, history: Optional[List[dict]] = None) -> int:
+    """Prompt tokens a chat request for this question, context and history costs"""
+    return count_message_tokens(build_chat_messages(user_message, context, history))
+
+async def load_session(session_id: Optional[str]) -> Tuple[Optional[Session], List[dict]]:
+    """Return the conversation session (if any) and its history, compacted to the history token budget"""
+    if not session_id or not session_store:
+        return None, []
+    session = await asyncio.get_running_loop().run_in_executor(None, session_store.get, session_id)
+    history = history_messages(session)
+    if history:
+        HISTORY_TOKENS.observe(count_message_tokens(history) - 3)
+    return session, history
+
+async def record_turn(session: Optional[Session], question: str, answer: str, retrieval_query: str):
+    if session:
+        await asyncio.get_running_loop().run_in_executor(
+            None, session_store.append, session.id, question, answer, retrieval_query
+        )
+
+async def lookup_cached_answer(user_message: str, sources: List[str]) -> Tuple[Optional[str], Optional[List[float]]]:
+    """Return (cached answer or None, question embedding) when the answer cache is enabled"""
+    if not answer_cache or not rag_service:
+        return None, None
+    try:
+        embedding = await rag_service.aembed_query(user_message)
+    except Exception as e:
+        ERRORS.inc(stage="answer_cache")
+        logger.warning("Error embedding question for answer cache: %s", e)
+        return None, None
+    with timed("answer_cache_lookup"):
+        answer = answer_cache.lookup(embedding, sources)
+    CACHE_LOOKUPS.inc(cache="answers", result="miss" if answer is None else "hit")
+    return answer, embedding
+
+async def remember_answer(embedding: Optional[List[float]], sources: List[str], question: str, answer: str, tokens: int):
+    """Store a successful answer and periodically persist the cache to disk"""
+    if embedding is None or tokens <= 0:
+        return
+    answer_cache.store(embedding, sources, question, answer, tokens)
+    if answer_cache.unsaved_changes >= ANSWER_CACHE_SAVE_EVERY:
+        await asyncio.get_running_loop().run_in_executor(None, answer_cache.save)
+
+# Rolling window of streaming timings (seconds) for /ask/stats
+GENERATION_STATS_WINDOW = int(os.getenv("GENERATION_STATS_WINDOW", "1000"))
+# time_to_first_token counts from request arrival (session, retrieval and all); generation_first_token
+# and total_generation_time from the start of generation
+generation_stats = {
+    "time_to_first_token": deque(maxlen=GENERATION_STATS_WINDOW),
+    "generation_first_token": deque(maxlen=GENERATION_STATS_WINDOW),
+    "total_generation_time": deque(maxlen=GENERATION_STATS_WINDOW),
+}
+
+def summarize_timings(values) -> dict:
+    """Summarize a window of timings as count and millisecond percentiles"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+    return {"count": len(ordered), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99)}
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.post("/ask")
 async def ask_chatbot(request: ChatRequest):
     """Chatbot endpoint with RAG-enhanced ChatGPT responses and UI metadata"""
     try:
         user_message = request.question
-        context = ""
-        rag_used = False
-        sources = []
-        similar_docs = []
-        
-        # Only use RAG if enabled and service is available
-        if request.rag and rag_service:
-            try:
-                similar_docs = rag_service.search_similar_documents(user_message, top_k=3)
-                context = "\n\n".join([f"Document ({doc['metadata']}): {doc['content']}" for doc in similar_docs])
-                if context.strip():
-                    rag_used = True
-                    sources = [doc['metadata'] for doc in similar_docs if doc.get('metadata')]
-                    print(f"🔍 Found relevant context for query: '{user_message[:50]}...' (RAG used)")
-            except Exception as e:
-                print(f"⚠️  Error retrieving context: {e}")
+        session, history = await load_session(request.session_id)
+        # Follow-ups are retrieved (and answer-cached) as standalone questions
+        retrieval_query = rewrite_query(session, user_message)
+        context = await retrieve_context(retrieval_query, request.rag, request.search_mode)
+        sources = context.sources
+        prompt_tokens = prompt_token_count(user_message, context.text, history)
         
         # Use ChatGPT if available, otherwise use demo responses
+        cached = False
+        answered = True
         if openai_client:
-            response = await get_chatgpt_response(user_message, context)
+            response, question_embedding = await lookup_cached_answer(retrieval_query, sources)
+            cached = response is not None
+            if not cached:
+                PROMPT_TOKENS.observe(prompt_tokens)
+                response, tokens = await get_chatgpt_response(user_message, context.text, history)
+                await remember_answer(question_embedding, sources, retrieval_query, response, tokens)
+                # Failed calls return an apology without usage; keep it out of the history
+                answered = tokens > 0
         else:
+            FALLBACKS.inc(kind="demo_response")
             response = get_demo_response(user_message)
+        if answered:
+            await record_turn(session, user_message, response, retrieval_query)
         
-        return {"answer": response, "rag_used": rag_used, "sources": sources}
+        return {"answer": response, "rag_used": bool(context.text), "sources": sources, "cached": cached,
+                "prompt_tokens": prompt_tokens, "context_tokens": context.tokens,
+                "session_id": session.id if session else None}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post("/ask/stream")
+async def ask_chatbot_stream(request: ChatRequest):
+    """Streaming chatbot endpoint that sends tokens as Server-Sent Events"""
+    received = time.perf_counter()
+    user_message = request.question
+    session, history = await load_session(request.session_id)
+    retrieval_query = rewrite_query(session, user_message)
+    context = await retrieve_context(retrieval_query, request.rag, request.search_mode)
+    sources = context.sources
+    prompt_tokens = prompt_token_count(user_message, context.text, history)
+    
+    async def event_stream():
+        yield sse_event("meta", {"rag_used": bool(context.text), "sources": sources,
+                                 "prompt_tokens": prompt_tokens, "context_tokens": context.tokens,
+                                 "session_id": session.id if session else None})
+        
+        start = time.perf_counter()
+        first_token_at = None
+        cached_answer, question_embedding = None, None
+        usage = {}
+        if openai_client:
+            cached_answer, question_embedding = await lookup_cached_answer(retrieval_query, sources)
+        if cached_answer is not None:
+            tokens = stream_text(cached_answer)
+        elif openai_client:
+            PROMPT_TOKENS.observe(prompt_tokens)
+            tokens = stream_chatgpt_response(user_message, context.text, usage, history)
+        else:
+            FALLBACKS.inc(kind="demo_response")
+            tokens = stream_text(get_demo_response(user_message))
+        answer_parts = []
+        async for token in tokens:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            answer_parts.append(token)
+            yield sse_event("token", {"text": token})
+        end = time.perf_counter()
+        
+        answer = "".join(answer_parts)
+        if cached_answer is None:
+            await remember_answer(question_embedding, sources, retrieval_query, answer, usage.get("total_tokens", 0))
+        if cached_answer is not None or not openai_client or usage.get("total_tokens", 0) > 0:
+            await record_turn(session, user_message, answer, retrieval_query)
+        
+        ttft = (first_token_at or end) - received
+        generation_ttft = (first_token_at or end) - start
+        generation_stats["time_to_first_token"].append(ttft)
+        generation_stats["generation_first_token"].append(generation_ttft)
+        generation_stats["total_generation_time"].append(end - start)
+        record_stage("first_token", ttft)
+        record_stage("llm_first_token", generation_ttft)
+        record_stage("llm_stream", end - start)
+        logger.debug("Streamed answer: first token %.0fms after the request (%.0fms after generation started), "
+                     "generation %.0fms", ttft * 1000, generation_ttft * 1000, (end - start) * 1000)
+        yield sse_event("done", {
+            "time_to_first_token_ms": round(ttft * 1000, 1),
+            "generation_first_token_ms": round(generation_ttft * 1000, 1),
+            "total_generation_ms": round((end - start) * 1000, 1),
+            "total_ms": round((end - received) * 1000, 1),
+        })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/ask/cache/stats")
+async def ask_cache_stats():
+    """Hit rate and estimated tokens saved by the semantic answer cache"""
+    if not answer_cache:
+        return {"enabled": False}
+    return {"enabled": True, **answer_cache.stats()}
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Sessions and memory held by the conversation store, and evictions by reason"""
+    if not session_store:
+        return {"enabled": False}
+    return {"enabled": True, **session_store.stats()}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Turns, summary and memory use of one conversation"""
+    if not session_store:
+        raise HTTPException(status_code=404, detail="Session not found")
+    session = await asyncio.get_running_loop().run_in_executor(None, session_store.get, session_id, False)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {
+        "session_id": session.id,
+        "turns": [{"question": question, "answer": answer} for question, answer in session.turns],
+        "summary": session.summary,
+        "bytes": session.nbytes,
+        "history_tokens": count_message_tokens(history_messages(session)) - 3,
+    }
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Forget a conversation"""
+    if not session_store:
+        raise HTTPException(status_code=404, detail="Session not found")
+    found = await asyncio.get_running_loop().run_in_executor(None, session_store.delete, session_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"deleted": session_id}
+
+@app.get("/ask/stats")
+async def ask_stats():
+    """Time to first token (from the request and from generation start) and generation time for recent streamed answers"""
+    return {name: summarize_timings(values) for name, values in generation_stats.items()}
+
+def embedding_busy(route: str, error: EmbeddingServerBusy) -> HTTPException:
+    """503 for a request the shared inference process turned away because its queue is full"""
+    ADMISSION_REJECTED.inc(route=route, reason="embedding_busy")
+    return HTTPException(status_code=503, detail=f"Embedding server busy ({error})",
+                         headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+
 @app.post("/documents")
 async def add_document(request: DocumentRequest):
     """Add a document to the vector database"""
@@ -161,23 +580,102 @@ async def add_document(request: DocumentRequest):
         raise HTTPException(status_code=503, detail="RAG service not available")
     
     try:
-        rag_service.add_documents([{
-            "content": request.content,
-            "metadata": request.metadata
-        }])
-        return {"message": "Document added successfully"}
+        # Long content is split into overlapping chunks that fit the model and the schema
+        with timed("documents_chunk"):
+            chunks = list(chunk_documents([{
+                "content": request.content,
+                "metadata": request.metadata
+            }], rag_service.tokenizer))
+        if not chunks:
+            raise HTTPException(status_code=400, detail="Document content is empty")
+        with timed("documents_add"):
+            await rag_service.aadd_documents(chunks)
+        return {"message": "Document added successfully", "chunks": len(chunks)}
+    except HTTPException:
+        raise
+    except EmbeddingServerBusy as e:
+        raise embedding_busy("/documents", e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding document: {str(e)}")
 
+async def spool_to_file(chunks, suffix: str) -> str:
+    """Copy an async stream of bytes to a temp file without holding it in memory"""
+    fd, path = tempfile.mkstemp(prefix="ingest-", suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        async for chunk in chunks:
+            f.write(chunk)
+    return path
+
+async def iter_upload(upload: UploadFile, chunk_size: int = 1024 * 1024):
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+@app.post("/documents/bulk", status_code=202)
+async def bulk_add_documents(request: Request):
+    """Start a bulk ingestion job from a JSONL body or multipart file uploads.
+
+    Send `application/x-ndjson` (one {"content", "metadata"} object per line),
+    or `multipart/form-data` with one or more files: `.jsonl` files are read
+    line by line and any other file is ingested as a single text document.
+    """
+    if not rag_service:
+        raise HTTPException(status_code=503, detail="RAG service not available")
+    
+    sources = []
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            for _, upload in form.multi_items():
+                if not hasattr(upload, "filename"):
+                    continue
+                filename = upload.filename or "upload"
+                kind = "jsonl" if filename.endswith((".jsonl", ".ndjson")) else "text"
+                sources.append((await spool_to_file(iter_upload(upload), "." + kind), kind, filename))
+        else:
+            sources.append((await spool_to_file(request.stream(), ".jsonl"), "jsonl", ""))
+    except Exception as e:
+        for path, _, _ in sources:
+            os.remove(path)
+        raise HTTPException(status_code=400, detail=f"Error reading upload: {str(e)}")
+    
+    if not sources:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    
+    job = ingestion_manager.submit(sources)
+    return job.to_dict()
+
+@app.get("/documents/bulk")
+async def list_bulk_jobs():
+    """List recent bulk ingestion jobs"""
+    if not ingestion_manager:
+        raise HTTPException(status_code=503, detail="RAG service not available")
+    return {"jobs": [job.to_dict() for job in ingestion_manager.jobs()]}
+
+@app.get("/documents/bulk/{job_id}")
+async def get_bulk_job(job_id: str):
+    """Get progress and throughput of a bulk ingestion job"""
+    job = ingestion_manager.get(job_id) if ingestion_manager else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job.to_dict()
+
 @app.get("/documents/search")
-async def search_documents(query: str, top_k: int = 3):
-    """Search documents in the vector database"""
+async def search_documents(query: str, top_k: int = Query(3, ge=1, le=MAX_TOP_K), mode: Optional[SearchMode] = None):
+    """Search documents with vector, BM25 keyword or hybrid retrieval, with per-stage timings"""
     if not rag_service:
         raise HTTPException(status_code=503, detail="RAG service not available")
     
     try:
-        results = rag_service.search_similar_documents(query, top_k)
-        return {"results": results}
+        results, timings = await rag_service.asearch_with_timings(query, top_k, mode)
+        return {"results": results, "timings_ms": {stage: round(ms, 3) for stage, ms in timings.items()}}
+    except EmbeddingServerBusy as e:
+        raise embedding_busy("/documents/search", e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
 
@@ -188,93 +686,168 @@ async def get_document_count():
         raise HTTPException(status_code=503, detail="RAG service not available")
     
     try:
-        count = rag_service.num_entities
+        count = await rag_service.acount_documents()
         return {"count": count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting document count: {str(e)}")
 
-def extract_text_from_image(image_bytes: bytes) -> str:
-    """Extract text from image using OCR"""
-    try:
-        # Open image using PIL
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Extract text using pytesseract (if available)
-        if TESSERACT_AVAILABLE:
-            try:
-                text = pytesseract.image_to_string(image)
-                return (text or "").strip()
-            except Exception as e:
-                print(f"OCR error: {e}")
-                return ""
-        else:
-            return ""
-    except Exception as e:
-        print(f"Error processing image: {e}")
-        return ""
+@app.get("/documents/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss/eviction counters for the embedding and search result caches"""
+    if not rag_service:
+        raise HTTPException(status_code=503, detail="RAG service not available")
+    
+    return {"caches": rag_service.cache_stats(), "batching": rag_service.batch_stats(), "bm25": rag_service.bm25_stats()}
 
-def analyze_food_image(image_bytes: bytes) -> str:
-    """Analyze food image and return nutrition information"""
+async def analyze_food_image(image: ProcessedImage) -> Tuple[str, bool]:
+    """Analyze food image and return (nutrition information, whether the vision model produced it)"""
     try:
-        # Extract text from image (nutrition labels, etc.)
-        extracted_text = extract_text_from_image(image_bytes)
-        
-        # Convert image to base64 for OpenAI vision API
-        image = Image.open(io.BytesIO(image_bytes))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Save to bytes buffer
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG')
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # Text from the image (nutrition labels, etc.) and the downscaled JPEG for the vision API
+        extracted_text = image.text
+        image_base64 = base64.b64encode(image.jpeg).decode('utf-8')
         
         # Use OpenAI Vision API if available
         if openai_client:
             try:
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are NutriVibe, a nutrition expert. Analyze this food image and provide detailed nutritional information. If you can see a nutrition label, extract the exact values. If not, estimate based on the food items visible. Be specific about calories, protein, carbs, fat, and other relevant nutrients. Format your response clearly with emojis and bullet points."
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Please analyze this food image and provide detailed nutritional information. If there's text in the image, here's what I extracted: '{extracted_text}'. Use this information along with visual analysis to provide accurate nutrition details."
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{image_base64}"
+                with timed("vision"):
+                    response = await openai_client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": "You are NutriVibe, a nutrition expert. Analyze this food image and provide detailed nutritional information. If you can see a nutrition label, extract the exact values. If not, estimate based on the food items visible. Be specific about calories, protein, carbs, fat, and other relevant nutrients. Format your response clearly with emojis and bullet points."
+                            },
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": f"Please analyze this food image and provide detailed nutritional information. If there's text in the image, here's what I extracted: '{extracted_text}'. Use this information along with visual analysis to provide accurate nutrition details."
+                                    },
+                                    {
+                                        "type": "image_url",
+                                        "image_url": {
+                                            "url": f"data:image/jpeg;base64,{image_base64}"
+                                        }
                                     }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=500,
-                    temperature=0.3
-                )
-                return response.choices[0].message.content
+                                ]
+                            }
+                        ],
+                        max_tokens=500,
+                        temperature=0.3
+                    )
+                return response.choices[0].message.content, True
             except Exception as e:
-                print(f"Error with OpenAI Vision API: {e}")
+                logger.error("Error with OpenAI Vision API: %s", e)
                 # Fall back to text-based analysis
         
         # Fallback analysis based on extracted text
+        FALLBACKS.inc(kind="vision_fallback")
         if extracted_text:
-            return f"📸 **Image Analysis Results**\n\nI found the following text in your image:\n\n```\n{extracted_text}\n```\n\nTo get detailed nutrition analysis, please set your OPENAI_API_KEY environment variable for full image recognition capabilities."
+            return f"📸 **Image Analysis Results**\n\nI found the following text in your image:\n\n```\n{extracted_text}\n```\n\nTo get detailed nutrition analysis, please set your OPENAI_API_KEY environment variable for full image recognition capabilities.", False
         else:
-            return "📸 **Image Analysis Results**\n\nI couldn't extract any text from your image. To get detailed nutrition analysis with food recognition, please set your OPENAI_API_KEY environment variable for full image recognition capabilities."
+            return "📸 **Image Analysis Results**\n\nI couldn't extract any text from your image. To get detailed nutrition analysis with food recognition, please set your OPENAI_API_KEY environment variable for full image recognition capabilities.", False
             
     except Exception as e:
-        return f"❌ Error analyzing image: {str(e)}"
+        return f"❌ Error analyzing image: {str(e)}", False
+
+async def analyze_upload(image_bytes: bytes) -> Tuple[str, bool]:
+    """Run the image pipeline, reusing cached OCR text and analyses; returns (analysis, cached)"""
+    loop = asyncio.get_running_loop()
+    # Decode, downscale and hash once in a worker process
+    with timed("image_decode"):
+        processed = await image_pipeline.process(image_bytes)
+    
+    cached = None
+    if image_cache:
+        with timed("image_cache_lookup"):
+            cached = await loop.run_in_executor(
+                None, image_cache.lookup, processed.content_hash, processed.dhash, processed.aspect
+            )
+    exact = cached is not None and cached["match"] == "exact"
+    if exact:
+        CACHE_LOOKUPS.inc(cache="images", result="exact")
+        if cached["analysis"] is not None:
+            return cached["analysis"], True
+    elif cached is None:
+        CACHE_LOOKUPS.inc(cache="images", result="miss")
+    
+    if exact and cached["ocr_text"] is not None:
+        processed.text = cached["ocr_text"]
+    else:
+        with timed("ocr"):
+            processed.text = await image_pipeline.ocr(processed)
+    
+    if cached and not exact:
+        # A similar-looking photo may be a different label; reuse its analysis only if it reads the same
+        confirmed = await loop.run_in_executor(None, image_cache.confirm_near, cached, processed.text)
+        CACHE_LOOKUPS.inc(cache="images", result="near" if confirmed else "near_rejected")
+        if confirmed and cached["analysis"] is not None:
+            await loop.run_in_executor(
+                None, lambda: image_cache.store(
+                    processed.content_hash, processed.dhash, processed.aspect,
+                    ocr_text=processed.text, analysis=cached["analysis"],
+                )
+            )
+            return cached["analysis"], True
+    
+    analysis, from_vision = await analyze_food_image(processed)
+    if image_cache:
+        # Fallback answers aren't cached so a later upload still gets the vision model
+        await loop.run_in_executor(
+            None, lambda: image_cache.store(
+                processed.content_hash, processed.dhash, processed.aspect,
+                ocr_text=processed.text, analysis=analysis if from_vision else None,
+            )
+        )
+    return analysis, False
+
+async def read_upload(upload: UploadFile, limit: int) -> bytes:
+    """Read an upload into memory, rejecting it with 413 once it exceeds limit bytes"""
+    if upload.size is not None and upload.size > limit:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+    buffer = bytearray()
+    async for chunk in iter_upload(upload):
+        buffer.extend(chunk)
+        if len(buffer) > limit:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+    return bytes(buffer)
+
+@app.middleware("http")
+async def limit_image_uploads(request: Request, call_next):
+    # Reject oversized image uploads from Content-Length before the body is read
+    if request.url.path == "/analyze-image":
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > IMAGE_MAX_UPLOAD_BYTES + 64 * 1024:
+            return JSONResponse({"detail": f"Upload exceeds the {IMAGE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"}, status_code=413)
+    return await call_next(request)
+
+# Per-endpoint concurrency limits and bounded queues (ADMISSION_LIMITS), applied before any work is done
+admission_limiters = build_limiters()
+app.add_middleware(AdmissionMiddleware, limiters=admission_limiters)
+
+# Added last so it wraps every other middleware and times the whole request, rejections included
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Concurrency, queue and rejection counts per admission-controlled endpoint in this worker"""
+    stats = {"pid": os.getpid(), "endpoints": {path: limiter.stats() for path, limiter in admission_limiters.items()}}
+    if rag_service and hasattr(rag_service.embedding_model, "stats"):
+        # Shared inference process (EMBEDDING_SERVER_SOCKET)
+        try:
+            stats["embedding_server"] = await asyncio.to_thread(rag_service.embedding_model.stats)
+        except Exception as e:
+            stats["embedding_server"] = {"error": str(e)}
+    return stats
+
+@app.get("/analyze-image/cache/stats")
+async def image_cache_stats():
+    """Exact and near-duplicate hit rates of the image cache, and collapsed concurrent uploads"""
+    stats = {"enabled": image_cache is not None, "single_flight": image_flights.stats()}
+    if image_cache:
+        stats.update(image_cache.stats())
+    return stats
 
 @app.post("/analyze-image")
 async def analyze_image(image: UploadFile = File(...)):
@@ -284,14 +857,21 @@ async def analyze_image(image: UploadFile = File(...)):
         if not image.content_type or not image.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read image bytes
-        image_bytes = await image.read()
+        # Read image bytes, stopping at the size limit
+        image_bytes = await read_upload(image, IMAGE_MAX_UPLOAD_BYTES)
         
-        # Analyze the image
-        analysis = analyze_food_image(image_bytes)
+        # Identical uploads in flight at the same time share one analysis
+        upload_hash = hashlib.sha256(image_bytes).hexdigest()
+        analysis, cached = await image_flights.run(upload_hash, lambda: analyze_upload(image_bytes))
         
-        return {"analysis": analysis}
+        return {"analysis": analysis, "cached": cached}
         
+    except HTTPException:
+        raise
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing image: {str(e)}")
 
@@ -0,0 +1,220 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    """Base for labelled metrics rendered in the Prometheus text format"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; each label set keeps bucket counts, sum and count"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, value) -> List[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time until the response headers are sent", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Latency of pipeline stages", ("stage",))
+STAGE_IN_FLIGHT = Gauge("stage_in_flight", "Pipeline stages currently running", ("stage",))
+ERRORS = Counter("errors_total", "Errors by pipeline stage", ("stage",))
+FALLBACKS = Counter("fallbacks_total", "Requests served by a degraded fallback path", ("kind",))
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+CACHE_ENTRIES = Gauge("cache_entries", "Entries currently held by each cache", ("cache",))
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192, 16384)
+PROMPT_TOKENS = Histogram("prompt_tokens", "Prompt tokens sent to the chat model per request", buckets=TOKEN_BUCKETS)
+CONTEXT_TOKENS = Histogram("context_tokens", "Tokens of RAG context added to the prompt", buckets=TOKEN_BUCKETS)
+HISTORY_TOKENS = Histogram("history_tokens", "Tokens of conversation history added to the prompt", buckets=TOKEN_BUCKETS)
+SESSION_BYTES = Histogram("session_bytes", "Memory held by a session after each turn", buckets=(1024, 4096, 16384, 65536, 262144, 1048576))
+SESSION_EVICTIONS = Counter("session_evictions_total", "Sessions dropped from memory", ("reason",))
+SESSIONS_ACTIVE = Gauge("sessions_active", "Conversation sessions held in memory")
+SESSION_MEMORY_BYTES = Gauge("session_memory_bytes", "Memory held by all in-memory sessions")
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests turned away by admission control", ("route", "reason"))
+ADMISSION_QUEUED = Gauge("admission_queued", "Requests waiting for an admission slot", ("route",))
+CONTEXT_PASSAGES_DROPPED = Counter("context_passages_dropped_total", "Retrieved passages left out of the prompt context", ("reason",))
+
+# Per-request stage timings (stage -> seconds); set by the middleware for each request
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+def record_stage(stage: str, seconds: float):
+    """Record a stage duration in the histogram and the current request's breakdown"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a block as a pipeline stage, counting it as in flight and as an error if it raises"""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        record_stage(stage, time.perf_counter() - start)
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Format stage timings as a Server-Timing header value (milliseconds)"""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+class MetricsMiddleware:
+    """ASGI middleware that counts requests and adds a Server-Timing breakdown header.
+
+    Runs in the request's own task, so stages timed by the handler land in
+    the same per-request timings dict.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        method = scope["method"]
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - start
+                route = getattr(scope.get("route"), "path", "unmatched")
+                HTTP_REQUEST_SECONDS.observe(elapsed, method=method, route=route)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, elapsed).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status))
+            _request_timings.reset(token)
@@ -1,66 +1,123 @@
+import fcntl
+import logging
 import os
-from typing import List, Dict, Optional
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from pymilvus import connections, Collection, CollectionSchema, FieldSchema, DataType, utility
-from sentence_transformers import SentenceTransformer
+from batching import MicroBatcher
+from cache import TTLCache
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_SERVER_SOCKET, load_embedding_model
+from vector_store import create_vector_store
+from bm25 import BM25Index, reciprocal_rank_fusion
+from metrics import CACHE_LOOKUPS, record_stage, timed
 
 load_dotenv()
 
-class MilvusRAGService:
-    def __init__(self):
-        self.collection_name = "documents"
-        # Use a large embedding model (bge-large-en-v1.5, 1024 dimensions)
-        self.embedding_model = SentenceTransformer('BAAI/bge-large-en-v1.5')
-        self.embedding_dim = 1024  # bge-large-en-v1.5 has 1024 dimensions
-        self._connect_to_milvus()
-        self._setup_collection()
-        self._add_sample_documents()
-
-    def _connect_to_milvus(self):
-        host = os.getenv("MILVUS_HOST")
-        port = os.getenv("MILVUS_PORT")
-        user = os.getenv("MILVUS_USER")
-        password = os.getenv("MILVUS_PASSWORD")
-        secure = os.getenv("MILVUS_SECURE", "true").lower() == "true"
+logger = logging.getLogger(__name__)
+
+# Max number of embedding/search calls running at once off the event loop
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "4"))
+
+# Micro-batching of concurrent queries: flush at max size or after max wait
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", "32"))
+SEARCH_BATCH_WAIT_MS = float(os.getenv("SEARCH_BATCH_WAIT_MS", "2"))
+
+# Query embedding cache (normalized text -> vector) and search result cache
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "600"))
+
+# Retrieval mode: dense "vector", lexical "bm25", or "hybrid" (both fused with reciprocal-rank fusion)
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+DEFAULT_SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid").lower()
+
+# Workers sharing an inference process (serve.py) also share the vector store, but a BM25 index or
+# result cache in one worker would never see documents added through another. Until those are shared
+# too, such workers serve uncached vector search only.
+SHARED_WORKERS = bool(EMBEDDING_SERVER_SOCKET)
+if SHARED_WORKERS:
+    RESULT_CACHE_SIZE = 0
+    SEARCH_MODES = ("vector",)
+    DEFAULT_SEARCH_MODE = "vector"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Largest top_k a search may ask for; concurrent searches share one vector store call sized by the largest
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "100"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+def normalize_query(query: str) -> str:
+    """Normalize query text so trivially different phrasings share cache entries"""
+    # bge models are uncased, so lowercasing does not change the embedding
+    return " ".join(query.lower().split())
+
+class RAGService:
+    def __init__(self, warm_up: bool = True):
+        # Bounded pool for document encoding/inserts and other blocking pymilvus RPCs
+        self._executor = ThreadPoolExecutor(max_workers=RAG_MAX_CONCURRENCY, thread_name_prefix="rag")
+        # Concurrent queries from /ask and /documents/search share encode and search calls
+        self._embed_batcher = MicroBatcher(self._encode_queries, EMBED_BATCH_SIZE, EMBED_BATCH_WAIT_MS, name="embed-batcher")
+        self._search_batcher = MicroBatcher(self._search_batch, SEARCH_BATCH_SIZE, SEARCH_BATCH_WAIT_MS, name="search-batcher")
+        # Repeated questions skip the encoder and the vector store round trip
+        self._embedding_cache = TTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+        self._result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS)
+        self._result_generation = 0
+        self.bm25 = BM25Index()
+        self.embedding_model = None
+        self.store = None
+        # Per-component warm-up state: pending, loading, ready or failed
+        self.components = {name: {"state": "pending"} for name in ("embedding_model", "vector_store", "collection", "bm25_index")}
+        self.ready = False
+        if warm_up:
+            self.warm_up()
+
+    def _warm_component(self, name: str, func):
+        self.components[name] = {"state": "loading"}
+        start = time.perf_counter()
         try:
-            connections.connect(
-                alias="default",
-                host=host,
-                port=port,
-                user=user,
-                password=password,
-                secure=secure
-            )
-            print("✅ Connected to managed Milvus successfully!")
+            func()
         except Exception as e:
-            print(f"⚠️  Could not connect to Milvus: {e}")
-            raise e
+            self.components[name] = {"state": "failed", "error": str(e)}
+            raise
+        self.components[name] = {"state": "ready", "seconds": round(time.perf_counter() - start, 2)}
 
-    def _setup_collection(self):
-        if utility.has_collection(self.collection_name):
-            print(f"✅ Collection '{self.collection_name}' already exists")
-            self.collection = Collection(self.collection_name)
-            return
-        fields = [
-            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
-            # Update dimension to 1024 for bge-large-en-v1.5
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.embedding_dim),
-            FieldSchema(name="metadata", dtype=DataType.VARCHAR, max_length=1024)
-        ]
-        schema = CollectionSchema(fields=fields, description="Document embeddings for RAG")
-        self.collection = Collection(name=self.collection_name, schema=schema)
-        index_params = {
-            "metric_type": "COSINE",
-            "index_type": "IVF_FLAT",
-            "params": {"nlist": 128}
-        }
-        self.collection.create_index(field_name="embedding", index_params=index_params)
-        print(f"✅ Created collection '{self.collection_name}' with index (dim={self.embedding_dim})")
+    def warm_up(self):
+        """Load the model, connect the vector store and build indexes; slow, so callers run it off the event loop"""
+        self._warm_component("embedding_model", self._load_embedding_model)
+        # Milvus or the in-process local index, selected by VECTOR_STORE
+        self._warm_component("vector_store", lambda: setattr(self, "store", create_vector_store(self.embedding_dim)))
+        self._warm_component("collection", lambda: self.store.load())
+        # Lexical index over the same documents, kept in step by insert_documents
+        if SHARED_WORKERS:
+            self.components["bm25_index"] = {"state": "disabled"}
+        else:
+            try:
+                self._warm_component("bm25_index", self.rebuild_bm25_index)
+            except Exception as e:
+                # Keyword search only covers documents added from now on
+                logger.warning("Could not build BM25 index from existing documents: %s", e)
+        if SHARED_WORKERS:
+            # Workers start together; the lock makes sure only the first one seeds the shared collection
+            with open(f"{EMBEDDING_SERVER_SOCKET}.seed.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._add_sample_documents()
+        else:
+            self._add_sample_documents()
+        self.ready = True
+
+    def _load_embedding_model(self):
+        # Model and backend come from EMBEDDING_MODEL / EMBEDDING_BACKEND (default bge-large on PyTorch)
+        self.embedding_model = load_embedding_model()
+        self.embedding_dim = self.embedding_model.dim
+        backend = "shared inference server" if EMBEDDING_SERVER_SOCKET else EMBEDDING_BACKEND
+        logger.info("Loaded embedding model '%s' (%s, dim=%d)", self.embedding_model.model_name, backend, self.embedding_dim)
 
     def _add_sample_documents(self):
-        if self.collection.num_entities > 0:
-            print("✅ Collection already has documents")
+        if self.store.count > 0:
+            logger.info("Collection already has documents")
             return
         sample_docs = [
             {"content": "FastAPI is a modern, fast web framework for building APIs with Python 3.7+ based on standard Python type hints. It's designed to be easy to use and learn, with automatic interactive API documentation.", "metadata": "fastapi_intro"},
@@ -75,45 +132,135 @@ class MilvusRAGService:
             {"content": "SQL (Structured Query Language) is a standard language for storing, manipulating, and retrieving data in relational database management systems.", "metadata": "sql_intro"}
         ]
         self.add_documents(sample_docs)
-        print(f"✅ Added {len(sample_docs)} sample documents to collection")
+        logger.info("Added %d sample documents to collection", len(sample_docs))
 
     def add_documents(self, documents: List[Dict[str, str]]):
         try:
-            contents = [doc["content"] for doc in documents]
-            metadatas = [doc.get("metadata", "") for doc in documents]
-            embeddings = self.embedding_model.encode(contents).tolist()
-            data = [contents, embeddings, metadatas]
-            self.collection.insert(data)
-            self.collection.flush()
-            print(f"✅ Added {len(documents)} documents to vector database")
+            self.insert_documents(documents)
+            self.flush()
+            logger.info("Added %d documents to vector database", len(documents))
         except Exception as e:
-            print(f"❌ Error adding documents: {e}")
+            logger.error("Error adding documents: %s", e)
             raise e
 
-    def search_similar_documents(self, query: str, top_k: int = 3) -> List[Dict]:
-        try:
-            self.collection.load()
-            query_embedding = self.embedding_model.encode([query]).tolist()
-            search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
-            results = self.collection.search(
-                data=query_embedding,
-                anns_field="embedding",
-                param=search_params,
-                limit=top_k,
-                output_fields=["content", "metadata"]
+    def insert_documents(self, documents: List[Dict[str, str]], encode_batch_size: int = 32):
+        """Encode and insert documents without flushing; call flush() when done"""
+        contents = [doc["content"] for doc in documents]
+        metadatas = [doc.get("metadata", "") for doc in documents]
+        with timed("ingest_encode"):
+            embeddings = self.embedding_model.encode(contents, batch_size=encode_batch_size)
+        with timed("ingest_insert"):
+            ids = self.store.insert(contents, embeddings, metadatas)
+        if not SHARED_WORKERS:
+            with timed("ingest_bm25"):
+                self.bm25.add(ids, contents)
+
+    def flush(self):
+        """Seal inserted data and make it visible to new searches"""
+        with timed("ingest_flush"):
+            self.store.flush()
+        self.invalidate_result_cache()
+
+    @property
+    def tokenizer(self):
+        return self.embedding_model.tokenizer
+
+    def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """Encode a batch of queries in a single model call"""
+        # Identical concurrent queries are encoded once
+        unique = list(dict.fromkeys(queries))
+        with timed("embedding_batch"):
+            vectors = dict(zip(unique, self.embedding_model.encode(unique).tolist()))
+        return [vectors[query] for query in queries]
+
+    def _search_batch(self, requests: List[Tuple[List[float], int]]) -> List[List[Dict]]:
+        """Run one vector store search for a batch of (embedding, top_k) requests"""
+        with timed("vector_search_batch"):
+            results = self.store.search(
+                [embedding for embedding, _ in requests],
+                limit=max(top_k for _, top_k in requests)
             )
-            similar_docs = []
-            for hits in results:
-                for hit in hits:
-                    similar_docs.append({
-                        "content": hit.entity.get("content"),
-                        "metadata": hit.entity.get("metadata"),
-                        "score": hit.score
-                    })
-            return similar_docs
-        except Exception as e:
-            print(f"❌ Error searching documents: {e}")
-            return []
+        return [hits[:top_k] for (_, top_k), hits in zip(requests, results)]
+
+    def _bm25_search(self, query: str, limit: int) -> Tuple[List[Tuple[int, float]], float]:
+        start = time.perf_counter()
+        hits = self.bm25.search(query, limit)
+        return hits, time.perf_counter() - start
+
+    def _fuse(self, vector_hits: List[Dict], bm25_hits: List[Tuple[int, float]], top_k: int) -> List[Dict]:
+        """Combine vector and BM25 rankings with reciprocal-rank fusion"""
+        docs = {hit["id"]: hit for hit in vector_hits}
+        bm25_scores = dict(bm25_hits)
+        fused = reciprocal_rank_fusion(
+            {"vector": [hit["id"] for hit in vector_hits], "bm25": [doc_id for doc_id, _ in bm25_hits]},
+            top_k, RRF_K
+        )
+        missing = [doc_id for doc_id, _ in fused if doc_id not in docs]
+        fetched = self.store.get(missing) if missing else {}
+        results = []
+        for doc_id, score in fused:
+            doc = docs.get(doc_id) or fetched.get(doc_id)
+            if doc is None:
+                continue
+            result = {"id": doc_id, "content": doc["content"], "metadata": doc["metadata"], "score": score}
+            if doc_id in docs:
+                result["vector_score"] = docs[doc_id]["score"]
+            if doc_id in bm25_scores:
+                result["bm25_score"] = bm25_scores[doc_id]
+            results.append(result)
+        return results
+
+    def _bm25_results(self, bm25_hits: List[Tuple[int, float]]) -> List[Dict]:
+        fetched = self.store.get([doc_id for doc_id, _ in bm25_hits])
+        return [
+            {"id": doc_id, "content": fetched[doc_id]["content"], "metadata": fetched[doc_id]["metadata"], "score": score}
+            for doc_id, score in bm25_hits if doc_id in fetched
+        ]
+
+    def rebuild_bm25_index(self):
+        """Index every stored document for lexical search"""
+        start = time.perf_counter()
+        bm25 = BM25Index()
+        for batch in self.store.iter_documents():
+            bm25.add([doc_id for doc_id, _ in batch], [content for _, content in batch])
+        self.bm25 = bm25
+        logger.info("BM25 index built for %d documents in %.1fs", len(bm25), time.perf_counter() - start)
+
+    def invalidate_result_cache(self):
+        """Drop cached search results after the collection changes"""
+        # Bumping the generation stops in-flight searches from caching stale results
+        self._result_generation += 1
+        self._result_cache.clear()
+
+    def _cached_results(self, key: str, top_k: int, mode: str) -> Optional[List[Dict]]:
+        docs = self._result_cache.get((key, top_k, mode))
+        return [dict(doc) for doc in docs] if docs is not None else None
+
+    def _store_results(self, key: str, top_k: int, mode: str, generation: int, docs: List[Dict]):
+        if generation == self._result_generation:
+            self._result_cache.put((key, top_k, mode), [dict(doc) for doc in docs])
+
+    def embed_query(self, query: str) -> List[float]:
+        """Return the (cached) embedding for a search query"""
+        key = normalize_query(query)
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = self._embed_batcher.submit(key).result()
+            self._embedding_cache.put(key, embedding)
+        return embedding
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """Async variant of embed_query that awaits the embedding batcher directly"""
+        key = normalize_query(query)
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = await asyncio.wrap_future(self._embed_batcher.submit(key))
+            self._embedding_cache.put(key, embedding)
+        return embedding
+
+    def search_similar_documents(self, query: str, top_k: int = 3, mode: Optional[str] = None) -> List[Dict]:
+        """Blocking variant of asearch_similar_documents for use outside the event loop"""
+        return asyncio.run(self.asearch_similar_documents(query, top_k, mode))
 
     def get_context_for_query(self, query: str, top_k: int = 3) -> str:
         similar_docs = self.search_similar_documents(query, top_k)
@@ -126,16 +273,116 @@ class MilvusRAGService:
 
     @property
     def num_entities(self):
-        return self.collection.num_entities
+        return self.store.count
+
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def asearch_similar_documents(self, query: str, top_k: int = 3, mode: Optional[str] = None) -> List[Dict]:
+        try:
+            docs, _ = await self.asearch_with_timings(query, top_k, mode)
+            return docs
+        except Exception as e:
+            logger.error("Error searching documents: %s", e)
+            return []
+
+    async def asearch_with_timings(self, query: str, top_k: int = 3, mode: Optional[str] = None) -> Tuple[List[Dict], Dict[str, float]]:
+        """Search with mode "vector", "bm25" or "hybrid" and return (results, per-stage milliseconds)"""
+        mode = mode or DEFAULT_SEARCH_MODE
+        if not 1 <= top_k <= MAX_TOP_K:
+            # Checked before batching, so one oversized request can't fail the searches batched with it
+            raise ValueError(f"top_k must be between 1 and {MAX_TOP_K}")
+        if mode not in SEARCH_MODES:
+            if SHARED_WORKERS:
+                raise ValueError(f"Search mode '{mode}' is not available with shared workers (use vector)")
+            raise ValueError(f"Unknown search mode '{mode}' (use one of {', '.join(SEARCH_MODES)})")
+        timings = {}
+        start = time.perf_counter()
+        key = normalize_query(query)
+        cached = self._cached_results(key, top_k, mode)
+        CACHE_LOOKUPS.inc(cache="search_results", result="miss" if cached is None else "hit")
+        if cached is not None:
+            timings["cache_ms"] = timings["total_ms"] = (time.perf_counter() - start) * 1000
+            record_stage("search_cache", timings["cache_ms"] / 1000)
+            return cached, timings
+        generation = self._result_generation
+        # Hybrid mode over-fetches from both retrievers so fusion has candidates to rerank
+        candidates = max(top_k, HYBRID_CANDIDATES) if mode == "hybrid" else top_k
+
+        async def vector_search():
+            stage_start = time.perf_counter()
+            query_embedding = await self.aembed_query(query)
+            timings["embedding_ms"] = (time.perf_counter() - stage_start) * 1000
+            stage_start = time.perf_counter()
+            hits = await asyncio.wrap_future(self._search_batcher.submit((query_embedding, candidates)))
+            timings["vector_search_ms"] = (time.perf_counter() - stage_start) * 1000
+            return hits
+
+        async def bm25_search():
+            hits, elapsed = await self._run_blocking(self._bm25_search, key, candidates)
+            timings["bm25_ms"] = elapsed * 1000
+            return hits
+
+        if mode == "vector":
+            docs = await vector_search()
+        elif mode == "bm25":
+            bm25_hits = await bm25_search()
+            docs = await self._run_blocking(self._bm25_results, bm25_hits)
+        else:
+            vector_hits, bm25_hits = await asyncio.gather(vector_search(), bm25_search())
+            stage_start = time.perf_counter()
+            docs = await self._run_blocking(self._fuse, vector_hits, bm25_hits, top_k)
+            timings["fusion_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        self._store_results(key, top_k, mode, generation, docs)
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        for stage, ms in timings.items():
+            if stage != "total_ms":
+                record_stage("search_" + stage[:-len("_ms")], ms / 1000)
+        return docs, timings
+
+    async def aadd_documents(self, documents: List[Dict[str, str]]):
+        """Async variant of add_documents that runs in the RAG executor"""
+        return await self._run_blocking(self.add_documents, documents)
+
+    async def acount_documents(self) -> int:
+        return await self._run_blocking(lambda: self.num_entities)
+
+    def batch_stats(self) -> Dict[str, Dict]:
+        return {
+            name: {"batches": batcher.batches, "items": batcher.items,
+                   "average_batch_size": round(batcher.average_batch_size, 2)}
+            for name, batcher in (("embedding", self._embed_batcher), ("search", self._search_batcher))
+        }
+
+    def bm25_stats(self) -> Dict:
+        return self.bm25.stats()
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        return {"embedding": self._embedding_cache.stats(), "results": self._result_cache.stats()}
+
+    def shutdown(self):
+        self._embed_batcher.close()
+        self._search_batcher.close()
+        self._executor.shutdown(wait=False)
+        if self.store:
+            self.store.close()
+        # Pooled connections of the shared inference server client
+        if hasattr(self.embedding_model, "close"):
+            self.embedding_model.close()
+
+# Kept for callers written before the vector store became pluggable
+MilvusRAGService = RAGService
 
 rag_service = None
 
-def get_rag_service() -> Optional[MilvusRAGService]:
+def get_rag_service() -> Optional[RAGService]:
     global rag_service
     if rag_service is None:
         try:
-            rag_service = MilvusRAGService()
+            rag_service = RAGService()
         except Exception as e:
-            print(f"⚠️  RAG service not available: {e}")
+            logger.warning("RAG service not available: %s", e)
             return None
     return rag_service 
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Multi-worker deployment: one shared embedding inference process plus N uvicorn workers.
+
+Starts inference_server.py on a Unix socket and `uvicorn main:app --workers N`
+with EMBEDDING_SERVER_SOCKET pointing at it, so the embedding model is held
+in memory once instead of once per worker. Workers wait for the inference
+process while it loads the model; it is restarted if it dies. OCR worker
+processes are split across HTTP workers unless OCR_WORKERS is set.
+
+    python serve.py --workers 4 --port 8000
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from logging_config import configure_logging
+
+logger = logging.getLogger("serve")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0")) or os.cpu_count() or 1
+
+def start_inference_server(socket_path: str, env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "inference_server.py"), "--socket", socket_path],
+                            cwd=ROOT, env=env)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="uvicorn worker processes (default: one per core)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVER_SOCKET") or "/tmp/vibe-embeddings.sock")
+    args = parser.parse_args()
+    configure_logging()
+
+    env = dict(os.environ, EMBEDDING_SERVER_SOCKET=args.socket)
+    # One OCR pool per worker; together they shouldn't oversubscribe the cores
+    env.setdefault("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    inference = start_inference_server(args.socket, env)
+    inference_started = time.monotonic()
+    web = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", args.host, "--port", str(args.port),
+                            "--workers", str(args.workers)], cwd=ROOT, env=env)
+    logger.info("Started inference server (pid %d) and %d uvicorn workers on port %d",
+                inference.pid, args.workers, args.port)
+
+    stopping = False
+    exit_code = 0
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while not stopping and web.poll() is None:
+            if inference.poll() is not None:
+                if time.monotonic() - inference_started < 60:
+                    # Most likely can't load the model; restarting would just fail again
+                    logger.error("Inference server failed to start (exit code %d)", inference.returncode)
+                    exit_code = 1
+                    break
+                # Workers reconnect on their next request
+                logger.error("Inference server exited with code %d - restarting", inference.returncode)
+                inference = start_inference_server(args.socket, env)
+                inference_started = time.monotonic()
+            time.sleep(0.5)
+    finally:
+        # Stop the web workers first so no request is cut off mid-embedding
+        for process in (web, inference):
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    sys.exit(exit_code or web.returncode or 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from context_builder import count_tokens, truncate_to_tokens
+from metrics import SESSION_BYTES, SESSION_EVICTIONS
+
+logger = logging.getLogger(__name__)
+
+# Turns kept per session; older turns are folded into a short summary
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "12"))
+# Sessions unused for this long are dropped (from memory and from SQLite)
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+# Cap on the text held by all in-memory sessions; least recently used sessions are evicted beyond it
+SESSION_MEMORY_MB = float(os.getenv("SESSION_MEMORY_MB", "64"))
+# Optional SQLite file so conversations survive restarts and memory evictions (empty = memory only)
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "")
+# Prompt budget for conversation history and for the summary of older turns
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "800"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "200"))
+
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+# Rough per-object overhead (bytes) added to text sizes when accounting session memory
+_SESSION_OVERHEAD = 400
+_TURN_OVERHEAD = 200
+
+FOLLOW_UP_PREFIXES = ("and ", "what about", "how about", "what of", "also ", "or ", "same ", "then ", "ok ", "okay ")
+FOLLOW_UP_WORDS = {"it", "its", "it's", "that", "this", "those", "these", "they", "them", "their"}
+STOP_WORDS = {"and", "what", "how", "about", "for", "of", "the", "a", "an", "is", "are", "in", "on", "with", "also", "or",
+              "then", "ok", "okay", "please", "instead", "too", "does", "do", "there", "much", "many", "any", "one", "ones", "same"} | FOLLOW_UP_WORDS
+
+class Session:
+    """One conversation: a ring buffer of recent (question, answer) turns and a summary of older ones"""
+
+    __slots__ = ("id", "turns", "summary", "topic_query", "last_used", "nbytes")
+
+    def __init__(self, session_id: str, max_turns: int = SESSION_MAX_TURNS):
+        self.id = session_id
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        # Last standalone retrieval query; follow-up questions are resolved against it
+        self.topic_query = ""
+        self.last_used = time.time()
+        self.nbytes = _SESSION_OVERHEAD
+
+    def snapshot(self) -> "Session":
+        """A copy that callers can read without the store's lock while new turns are appended"""
+        copy = Session(self.id, self.turns.maxlen)
+        copy.turns.extend(self.turns)
+        copy.summary, copy.topic_query, copy.last_used, copy.nbytes = self.summary, self.topic_query, self.last_used, self.nbytes
+        return copy
+
+    def _measure(self):
+        self.nbytes = (_SESSION_OVERHEAD + len(self.summary) + len(self.topic_query)
+                       + sum(_TURN_OVERHEAD + len(question) + len(answer) for question, answer in self.turns))
+
+def _first_sentence(text: str, max_chars: int = 160) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", " ".join(text.split()), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+def _fold(summary: str, question: str, answer: str, max_tokens: int) -> str:
+    """Add a turn that fell out of the ring buffer to the summary, keeping its most recent part within max_tokens"""
+    line = f"- User asked: {_first_sentence(question)} Answer: {_first_sentence(answer)}"
+    summary = f"{summary}\n{line}" if summary else line
+    while count_tokens(summary) > max_tokens and "\n" in summary:
+        summary = summary.split("\n", 1)[1]
+    return truncate_to_tokens(summary, max_tokens)
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question only makes sense with the previous turn ("and for salmon?", "is it healthy?")"""
+    text = " ".join(question.lower().split())
+    words = re.findall(r"[\w']+", text)
+    if text.startswith(FOLLOW_UP_PREFIXES):
+        return True
+    return len(words) <= 8 and any(word in FOLLOW_UP_WORDS for word in words)
+
+def _subject(query: str) -> Optional[re.Match]:
+    # The thing a question is about usually ends it: "how much protein is in [chicken breast]?"
+    return re.search(r"\b(?:in|of|for|about|on)\s+(?:an?\s+|the\s+)?([\w' -]+?)\s*[?.!]*$", query, re.IGNORECASE)
+
+def rewrite_query(session: Optional[Session], question: str) -> str:
+    """Standalone retrieval query for a question in a conversation.
+
+    Standalone questions are used unchanged so they share embedding and
+    search cache entries with stateless requests. Follow-ups are resolved
+    deterministically against the session's last standalone question:
+    "what about salmon?" swaps the subject ("how much protein is in
+    salmon?") and "is it healthy?" substitutes it ("is chicken breast
+    healthy?"), so they hit the same cache entries as if asked directly.
+    """
+    if session is None or not session.topic_query or not is_follow_up(question):
+        return question
+    topic = session.topic_query
+    subject = _subject(topic)
+    words = re.findall(r"[\w']+", question)
+    pronouns = [word for word in words if word.lower() in FOLLOW_UP_WORDS]
+    keywords = [word for word in words if word.lower() not in STOP_WORDS]
+    if subject and pronouns:
+        return re.sub(rf"\b{re.escape(pronouns[0])}\b(\s+ones?\b)?", subject.group(1), question, count=1)
+    if subject and keywords:
+        return topic[:subject.start(1)] + " ".join(keywords) + topic[subject.end(1):]
+    return f"{topic} {' '.join(keywords)}".strip()
+
+class SessionStore:
+    """In-process conversation store bounded by turns per session, idle time and total memory.
+
+    Sessions live in an LRU-ordered dict. When SQLite persistence is
+    enabled, each turn is appended as its own row, so worker processes
+    sharing the file add to a conversation instead of overwriting each
+    other's copy. Sessions evicted for memory, or updated by another
+    worker, are reloaded on their next request. get() returns snapshots,
+    so callers never iterate turns that another thread is appending to.
+    """
+
+    def __init__(self, max_turns: int = SESSION_MAX_TURNS, idle_seconds: float = SESSION_IDLE_SECONDS,
+                 memory_mb: float = SESSION_MEMORY_MB, path: str = SESSION_STORE_PATH,
+                 summary_tokens: int = SESSION_SUMMARY_TOKENS):
+        self.max_turns = max_turns
+        self.idle_seconds = idle_seconds
+        self.max_bytes = int(memory_mb * 1024 * 1024)
+        self.summary_tokens = summary_tokens
+        self.nbytes = 0
+        self.evictions = {"idle": 0, "memory": 0}
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(sessions)")]
+            if "turns" in columns:
+                # Older files kept all turns in one row; their short-lived sessions are dropped
+                self._db.execute("DROP TABLE sessions")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, summary TEXT NOT NULL, topic_query TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS session_turns ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS session_turns_session ON session_turns (session_id, seq)")
+            self._db.commit()
+            logger.info("Session store persisted to %s", path)
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT summary, topic_query, last_used FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or time.time() - row[2] > self.idle_seconds:
+            return None
+        session = Session(session_id, self.max_turns)
+        session.summary, session.topic_query, session.last_used = row
+        session.turns.extend(self._db.execute(
+            "SELECT question, answer FROM session_turns WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall())
+        return session
+
+    def _append_persisted(self, session: Session, question: str, answer: str, retrieval_query: str):
+        # One transaction, so workers appending to the same conversation are serialized by SQLite
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = db.execute("SELECT summary, topic_query FROM sessions WHERE id = ?", (session.id,)).fetchone()
+            summary, topic_query = row or (session.summary, session.topic_query)
+            if retrieval_query == question:
+                topic_query = question
+            db.execute("INSERT INTO session_turns (session_id, question, answer) VALUES (?, ?, ?)",
+                       (session.id, question, answer))
+            turns = db.execute(
+                "SELECT seq, question, answer FROM session_turns WHERE session_id = ? ORDER BY seq", (session.id,)
+            ).fetchall()
+            folded = turns[:max(0, len(turns) - self.max_turns)]
+            for _, old_question, old_answer in folded:
+                summary = _fold(summary, old_question, old_answer, self.summary_tokens)
+            db.executemany("DELETE FROM session_turns WHERE seq = ?", [(seq,) for seq, _, _ in folded])
+            db.execute("INSERT OR REPLACE INTO sessions (id, summary, topic_query, last_used) VALUES (?, ?, ?, ?)",
+                       (session.id, summary, topic_query, now))
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        session.turns.clear()
+        session.turns.extend((turn_question, turn_answer) for _, turn_question, turn_answer in turns[len(folded):])
+        session.summary, session.topic_query, session.last_used = summary, topic_query, now
+
+    def _changed_elsewhere(self, session: Session) -> bool:
+        # With several worker processes sharing the SQLite file, another worker may have recorded newer turns
+        if self._db is None:
+            return False
+        row = self._db.execute("SELECT last_used FROM sessions WHERE id = ?", (session.id,)).fetchone()
+        return row is not None and row[0] > session.last_used
+
+    def _remove(self, session_id: str, reason: Optional[str] = None):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.nbytes -= session.nbytes
+            if reason:
+                self.evictions[reason] += 1
+                SESSION_EVICTIONS.inc(reason=reason)
+
+    def _sweep(self, now: float):
+        # Sessions are in least recently used order, so idle ones are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_seconds:
+                break
+            self._remove(session.id, "idle")
+        if self._db is not None:
+            cutoff = now - self.idle_seconds
+            self._db.execute("DELETE FROM session_turns WHERE session_id IN (SELECT id FROM sessions WHERE last_used < ?)", (cutoff,))
+            self._db.execute("DELETE FROM sessions WHERE last_used < ?", (cutoff,))
+            self._db.commit()
+        self._last_sweep = now
+
+    def _enforce_memory(self, keep: str):
+        while self.nbytes > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._remove(oldest, "memory")
+
+    def get(self, session_id: str, create: bool = True) -> Optional[Session]:
+        """Return a snapshot of the session (loading it from SQLite if needed), creating it if asked"""
+        with self._lock:
+            now = time.time()
+            if now - self._last_sweep > 60:
+                self._sweep(now)
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.last_used > self.idle_seconds:
+                self._remove(session_id, "idle")
+                session = None
+            if session is not None and self._changed_elsewhere(session):
+                self._remove(session_id)
+                session = None
+            if session is None:
+                session = self._load(session_id)
+                if session is None and not create:
+                    return None
+                session = session or Session(session_id, self.max_turns)
+                session._measure()
+                self._sessions[session_id] = session
+                self.nbytes += session.nbytes
+                self._enforce_memory(session_id)
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            return session.snapshot()
+
+    def append(self, session_id: str, question: str, answer: str, retrieval_query: str):
+        """Record a turn, folding the turn that falls out of the ring buffer into the summary"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            if self._db is not None:
+                self._append_persisted(session, question, answer, retrieval_query)
+            else:
+                if len(session.turns) == session.turns.maxlen:
+                    session.summary = _fold(session.summary, *session.turns[0], self.summary_tokens)
+                session.turns.append((question, answer))
+                if retrieval_query == question:
+                    session.topic_query = question
+                session.last_used = time.time()
+            self.nbytes -= session.nbytes
+            session._measure()
+            self.nbytes += session.nbytes
+            SESSION_BYTES.observe(session.nbytes)
+            self._enforce_memory(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            found = session_id in self._sessions
+            self._remove(session_id)
+            if self._db is not None:
+                self._db.execute("DELETE FROM session_turns WHERE session_id = ?", (session_id,))
+                found = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0 or found
+                self._db.commit()
+            return found
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sizes = [session.nbytes for session in self._sessions.values()]
+            return {
+                "sessions": len(sizes),
+                "memory_bytes": self.nbytes,
+                "max_memory_bytes": self.max_bytes,
+                "average_session_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+                "largest_session_bytes": max(sizes, default=0),
+                "turns": sum(len(session.turns) for session in self._sessions.values()),
+                "evictions": dict(self.evictions),
+                "persistent": self._db is not None,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+def history_messages(session: Optional[Session], max_tokens: int = SESSION_HISTORY_TOKENS) -> List[Dict[str, str]]:
+    """Recent turns as chat messages within max_tokens, newest kept first, led by the summary of older turns"""
+    if session is None:
+        return []
+    messages = []
+    budget = max_tokens
+    for question, answer in reversed(session.turns):
+        question_tokens = count_tokens(question) + 4
+        if question_tokens + 16 > budget:
+            break
+        # Long answers are truncated rather than dropping the turn entirely
+        answer = truncate_to_tokens(answer, budget - question_tokens - 4)
+        budget -= question_tokens + count_tokens(answer) + 4
+        messages[:0] = [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    if session.summary:
+        summary = f"Summary of earlier turns in this conversation:\n{session.summary}"
+        if count_tokens(summary) + 4 <= budget:
+            messages.insert(0, {"role": "system", "content": summary})
+    return messages
@@ -0,0 +1,33 @@
+import threading
+import time
+
+import context_builder
+
+
+def test_token_counts_are_estimated_while_encoding_loads(monkeypatch):
+    release = threading.Event()
+
+    class Encoding:
+        def encode(self, text, disallowed_special=()):
+            return text.split()
+
+    def encoding_for_model(model):
+        # A download that hangs until released
+        release.wait(10)
+        return Encoding()
+
+    monkeypatch.setattr(context_builder, "TIKTOKEN_AVAILABLE", True)
+    monkeypatch.setattr(context_builder, "tiktoken", type("tiktoken", (), {"encoding_for_model": staticmethod(encoding_for_model)}),
+                        raising=False)
+    monkeypatch.setattr(context_builder, "_encoding", None)
+    monkeypatch.setattr(context_builder, "_encoding_loaded", False)
+    monkeypatch.setattr(context_builder, "_encoding_loading", False)
+
+    context_builder.start_loading_encoding()
+    assert context_builder.count_tokens("one two three four") == 5
+    release.set()
+    for _ in range(100):
+        if context_builder._encoding_loaded:
+            break
+        time.sleep(0.05)
+    assert context_builder.count_tokens("one two three four") == 4
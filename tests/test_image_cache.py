@@ -0,0 +1,15 @@
+from image_cache import ImageResultCache
+
+def test_near_duplicate_needs_matching_text(tmp_path):
+    cache = ImageResultCache(str(tmp_path / "images.sqlite3"), max_distance=8)
+    label_a = bytes(32)
+    cache.store("a", label_a, 1.0, ocr_text="Calories 250\nCarbs 31g", analysis="250 kcal")
+    # Same layout, a few bits apart: only a candidate until its text is checked
+    label_b = bytes([1, 3]) + bytes(30)
+    candidate = cache.lookup("b", label_b, 1.0)
+    assert candidate["match"] == "near"
+    assert not cache.confirm_near(candidate, "Calories 260\nCarbs 37g")
+    assert cache.confirm_near(candidate, "calories 250  carbs 31g")
+    stats = cache.stats()
+    assert (stats["near_hits"], stats["near_rejected"]) == (1, 1)
+    cache.close()
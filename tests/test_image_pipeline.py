@@ -0,0 +1,34 @@
+import io
+
+from PIL import ExifTags, Image
+
+from image_pipeline import process_image
+
+
+def jpeg(mode: str = "RGB", exif: Image.Exif = None) -> bytes:
+    buffer = io.BytesIO()
+    image = Image.new(mode, (64, 48), "white" if mode == "RGB" else (0, 0, 0, 0))
+    image.save(buffer, format="JPEG", **({"exif": exif} if exif is not None else {}))
+    return buffer.getvalue()
+
+
+def test_plain_rgb_jpeg_is_passed_through():
+    upload = jpeg()
+    assert process_image(upload, keep_gray=False).jpeg == upload
+
+
+def test_exif_is_stripped():
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = "Camera"
+    exif[ExifTags.Base.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (52.0, 31.0, 0.0)}
+    upload = jpeg(exif=exif)
+    assert Image.open(io.BytesIO(upload)).getexif()
+
+    processed = process_image(upload, keep_gray=False)
+    assert processed.jpeg != upload
+    assert not Image.open(io.BytesIO(processed.jpeg)).getexif()
+
+
+def test_cmyk_jpeg_is_converted_to_rgb():
+    processed = process_image(jpeg("CMYK"), keep_gray=False)
+    assert Image.open(io.BytesIO(processed.jpeg)).mode == "RGB"
@@ -0,0 +1,43 @@
+import socket
+import threading
+
+import numpy as np
+
+from inference_server import RemoteEncoder, pack_frame, recv_frame
+
+
+def serve_once(path: str):
+    """Answer one encode request on a new Unix socket, like a freshly restarted inference process"""
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    listener.settimeout(5)
+
+    def run():
+        connection, _ = listener.accept()
+        with connection, listener:
+            header, _ = recv_frame(connection)
+            vectors = np.ones((len(header["texts"]), 2), dtype=np.float32)
+            connection.sendall(pack_frame({"ok": True, "shape": list(vectors.shape)}, vectors.tobytes()))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_dead_pooled_connections_are_replaced(tmp_path):
+    path = str(tmp_path / "embeddings.sock")
+    encoder = RemoteEncoder.__new__(RemoteEncoder)
+    encoder.path, encoder.timeout, encoder.max_texts, encoder.dim = path, 5, 64, 2
+    encoder._lock = threading.Lock()
+    # Connections to an inference process that has since exited
+    encoder._pool = []
+    for _ in range(2):
+        client, server = socket.socketpair()
+        server.close()
+        encoder._pool.append(client)
+
+    thread = serve_once(path)
+    assert encoder.encode(["a", "b"]).shape == (2, 2)
+    thread.join()
+    assert len(encoder._pool) == 1
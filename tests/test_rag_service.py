@@ -0,0 +1,16 @@
+import asyncio
+
+import pytest
+
+from rag_service import MAX_TOP_K, RAGService
+
+
+@pytest.mark.parametrize("top_k", [0, -1, MAX_TOP_K + 1])
+def test_out_of_range_top_k_is_rejected_before_batching(top_k):
+    service = RAGService(warm_up=False)
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(service.asearch_with_timings("python", top_k, "vector"))
+        assert service.batch_stats()["search"]["items"] == 0
+    finally:
+        service.shutdown()
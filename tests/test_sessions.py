@@ -0,0 +1,44 @@
+import threading
+
+from sessions import SessionStore
+
+
+def test_workers_sharing_a_file_add_to_the_same_conversation(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SessionStore(max_turns=3, path=path), SessionStore(max_turns=3, path=path)
+    first.get("abc")
+    second.get("abc")
+    first.append("abc", "What is Milvus?", "A vector database.", "What is Milvus?")
+    second.append("abc", "Does it scale?", "Yes.", "Milvus scale")
+    first.append("abc", "Is it open source?", "Yes.", "Milvus open source")
+    second.append("abc", "Who maintains it?", "Zilliz.", "Milvus maintainers")
+
+    for store in (first, second):
+        session = store.get("abc")
+        assert [question for question, _ in session.turns] == [
+            "Does it scale?", "Is it open source?", "Who maintains it?"]
+        assert "What is Milvus?" in session.summary
+        assert session.topic_query == "What is Milvus?"
+    first.close()
+    second.close()
+
+
+def test_snapshot_is_not_mutated_by_appends():
+    store = SessionStore(max_turns=50, path="")
+    session = store.get("abc")
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            store.append("abc", "question", "answer", "question")
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(2000):
+            session = store.get("abc")
+            turns = len(session.turns)
+            assert sum(1 for _ in session.turns) == turns
+    finally:
+        stop.set()
+        thread.join()
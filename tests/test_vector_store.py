@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorStore, VectorStore
+
+def test_insert_is_searchable_before_flush(tmp_path):
+    store = LocalVectorStore(4, path=str(tmp_path / "index"))
+    store.insert(["first"], np.eye(4)[:1], ["a"])
+    store.flush()
+    # Bulk ingestion only flushes at the end of a job; searches in between must see the new rows
+    ids = store.insert(["second document", "third"], np.eye(4)[1:3], ["b", "c"])
+    hits = store.search(np.eye(4)[1:2], limit=1)[0]
+    assert hits[0]["id"] == ids[0]
+    assert hits[0]["content"] == "second document"
+    assert store.get(ids)[ids[1]] == {"content": "third", "metadata": "c"}
+    store.close()
+
+def test_vector_store_is_abstract():
+    with pytest.raises(TypeError):
+        VectorStore()
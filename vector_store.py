@@ -0,0 +1,361 @@
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from pymilvus import connections, Collection, CollectionSchema, FieldSchema, DataType, utility
+    PYMILVUS_AVAILABLE = True
+except ImportError:
+    PYMILVUS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Which vector store backs the RAG service: "milvus" (managed Milvus) or "local" (in-process)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "milvus").lower()
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", ".cache/vector_index")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32").lower()
+MILVUS_COLLECTION = os.getenv("MILVUS_COLLECTION", "documents")
+
+class VectorStore(ABC):
+    """Interface for the document stores behind RAGService.
+
+    Search results are lists of {"id", "content", "metadata", "score"} dicts,
+    best match first, with cosine similarity scores.
+    """
+
+    @abstractmethod
+    def insert(self, contents: List[str], embeddings: Sequence[Sequence[float]], metadatas: List[str]) -> List[int]:
+        ...
+
+    @abstractmethod
+    def flush(self):
+        ...
+
+    def load(self):
+        """Prepare the store for searching; called once at warm-up"""
+        pass
+
+    @abstractmethod
+    def search(self, embeddings: Sequence[Sequence[float]], limit: int) -> List[List[Dict]]:
+        ...
+
+    @abstractmethod
+    def get(self, ids: Sequence[int]) -> Dict[int, Dict]:
+        """Fetch {"content", "metadata"} for the given ids"""
+
+    @abstractmethod
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[List[Tuple[int, str]]]:
+        """Yield batches of (id, content) for every stored document"""
+
+    @property
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    def close(self):
+        pass
+
+class MilvusVectorStore(VectorStore):
+    """Managed Milvus collection with an IVF_FLAT cosine index"""
+
+    def __init__(self, dim: int, collection_name: str = MILVUS_COLLECTION):
+        if not PYMILVUS_AVAILABLE:
+            raise RuntimeError("pymilvus is not installed")
+        self.dim = dim
+        self.collection_name = collection_name
+        self._connect_to_milvus()
+        self._setup_collection()
+
+    def _connect_to_milvus(self):
+        uri = os.getenv("MILVUS_URI")
+        host = os.getenv("MILVUS_HOST")
+        port = os.getenv("MILVUS_PORT")
+        user = os.getenv("MILVUS_USER")
+        password = os.getenv("MILVUS_PASSWORD")
+        secure = os.getenv("MILVUS_SECURE", "true").lower() == "true"
+        try:
+            if uri:
+                # A local file path (e.g. ./milvus.db) runs Milvus Lite in-process; needs the milvus-lite package
+                connections.connect(alias="default", uri=uri, user=user or "", password=password or "")
+                logger.info("Connected to Milvus at %s", uri)
+                return
+            connections.connect(
+                alias="default",
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                secure=secure
+            )
+            logger.info("Connected to managed Milvus")
+        except Exception as e:
+            logger.warning("Could not connect to Milvus: %s", e)
+            raise e
+
+    def _setup_collection(self):
+        if utility.has_collection(self.collection_name):
+            logger.info("Collection '%s' already exists", self.collection_name)
+            self.collection = Collection(self.collection_name)
+            self._check_dimension()
+            return
+        fields = [
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dim),
+            FieldSchema(name="metadata", dtype=DataType.VARCHAR, max_length=1024)
+        ]
+        schema = CollectionSchema(fields=fields, description="Document embeddings for RAG")
+        self.collection = Collection(name=self.collection_name, schema=schema)
+        index_params = {
+            "metric_type": "COSINE",
+            "index_type": "IVF_FLAT",
+            "params": {"nlist": 128}
+        }
+        self.collection.create_index(field_name="embedding", index_params=index_params)
+        logger.info("Created collection '%s' with index (dim=%d)", self.collection_name, self.dim)
+
+    def _check_dimension(self):
+        for field in self.collection.schema.fields:
+            if field.name == "embedding" and int(field.params.get("dim", 0)) != self.dim:
+                raise ValueError(
+                    f"Collection '{self.collection_name}' stores {field.params.get('dim')}-dim embeddings "
+                    f"but the embedding model produces {self.dim}; set MILVUS_COLLECTION to a new "
+                    "collection or re-ingest with the original model"
+                )
+
+    def insert(self, contents, embeddings, metadatas):
+        embeddings = embeddings.tolist() if isinstance(embeddings, np.ndarray) else embeddings
+        result = self.collection.insert([contents, embeddings, metadatas])
+        return list(result.primary_keys)
+
+    def flush(self):
+        self.collection.flush()
+
+    def load(self):
+        # Loaded once at warm-up; newly inserted data stays searchable without reloading
+        self.collection.load()
+
+    def search(self, embeddings, limit):
+        search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
+        results = self.collection.search(
+            data=[list(embedding) for embedding in embeddings],
+            anns_field="embedding",
+            param=search_params,
+            limit=limit,
+            output_fields=["content", "metadata"]
+        )
+        return [
+            [
+                {
+                    "id": hit.id,
+                    "content": hit.entity.get("content"),
+                    "metadata": hit.entity.get("metadata"),
+                    "score": hit.score
+                }
+                for hit in hits
+            ]
+            for hits in results
+        ]
+
+    def get(self, ids):
+        if not ids:
+            return {}
+        rows = self.collection.query(expr=f"id in {[int(doc_id) for doc_id in ids]}", output_fields=["id", "content", "metadata"])
+        return {row["id"]: {"content": row["content"], "metadata": row["metadata"]} for row in rows}
+
+    def iter_documents(self, batch_size=1000):
+        iterator = self.collection.query_iterator(batch_size=batch_size, output_fields=["id", "content"])
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    return
+                yield [(row["id"], row["content"]) for row in rows]
+        finally:
+            iterator.close()
+
+    @property
+    def count(self) -> int:
+        return self.collection.num_entities
+
+class LocalVectorStore(VectorStore):
+    """In-process vector index stored in a memory-mapped file.
+
+    Vectors are L2-normalized and stored as float32, float16 or int8
+    (scaled by 127), so cosine similarity is a dot product. Search is a
+    blocked brute-force matmul with np.argpartition for top-k. Document
+    text and metadata live in a JSONL file next to the vectors and are read
+    back by byte offset only for the hits.
+    """
+
+    DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+    INITIAL_CAPACITY = 1024
+    SEARCH_BLOCK_ROWS = 65536
+
+    def __init__(self, dim: int, path: str = LOCAL_INDEX_PATH, dtype: str = LOCAL_INDEX_DTYPE):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported local index dtype '{dtype}' (use one of {', '.join(self.DTYPES)})")
+        self.dim = dim
+        self.path = path
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._meta_path = os.path.join(path, "index.json")
+        self._vectors_path = os.path.join(path, "vectors.bin")
+        self._docs_path = os.path.join(path, "documents.jsonl")
+        self._load()
+        logger.info("Local vector index ready at '%s' (%d vectors, dim=%d, %s)", path, self._count, dim, dtype)
+
+    def _load(self):
+        count = 0
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim or meta["dtype"] != self.dtype:
+                raise ValueError(
+                    f"Local index at '{self.path}' was built with dim={meta['dim']}, dtype={meta['dtype']} "
+                    f"but dim={self.dim}, dtype={self.dtype} was requested"
+                )
+            count = meta["count"]
+
+        # Byte offsets of each document line; entry i+1 is the end of document i
+        self._offsets = array("Q", [0])
+        if os.path.exists(self._docs_path):
+            with open(self._docs_path, "rb") as f:
+                for line in f:
+                    if len(self._offsets) > count:
+                        break
+                    self._offsets.append(self._offsets[-1] + len(line))
+        self._count = len(self._offsets) - 1
+        # Drop anything written after the last flush
+        with open(self._docs_path, "ab") as f:
+            f.truncate(self._offsets[-1])
+        self._docs_file = open(self._docs_path, "r+b")
+        self._docs_file.seek(0, os.SEEK_END)
+
+        itemsize = np.dtype(self.DTYPES[self.dtype]).itemsize
+        existing_rows = os.path.getsize(self._vectors_path) // (self.dim * itemsize) if os.path.exists(self._vectors_path) else 0
+        self._capacity = 0
+        self._vectors = None
+        self._ensure_capacity(max(self.INITIAL_CAPACITY, existing_rows, self._count))
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity:
+            return
+        capacity = max(rows, self._capacity * 2)
+        itemsize = np.dtype(self.DTYPES[self.dtype]).itemsize
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * itemsize)
+        self._vectors = np.memmap(self._vectors_path, dtype=self.DTYPES[self.dtype], mode="r+", shape=(capacity, self.dim))
+        self._capacity = capacity
+
+    def _quantize(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return np.clip(np.rint(vectors * 127), -127, 127).astype(np.int8)
+        return vectors.astype(self.DTYPES[self.dtype])
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def insert(self, contents, embeddings, metadatas):
+        vectors = self._normalize(embeddings)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim embeddings, got {vectors.shape[1]}")
+        lines = [
+            (json.dumps({"content": content, "metadata": metadata}, ensure_ascii=False) + "\n").encode("utf-8")
+            for content, metadata in zip(contents, metadatas)
+        ]
+        with self._lock:
+            start = self._count
+            self._ensure_capacity(start + len(lines))
+            self._vectors[start:start + len(lines)] = self._quantize(vectors)
+            self._docs_file.write(b"".join(lines))
+            # Searches read documents with os.pread, which can't see bytes still in Python's write buffer
+            self._docs_file.flush()
+            for line in lines:
+                self._offsets.append(self._offsets[-1] + len(line))
+            self._count = start + len(lines)
+        return list(range(start, start + len(lines)))
+
+    def flush(self):
+        with self._lock:
+            self._vectors.flush()
+            self._docs_file.flush()
+            os.fsync(self._docs_file.fileno())
+            tmp_path = self._meta_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype, "count": self._count}, f)
+            os.replace(tmp_path, self._meta_path)
+
+    def _scores(self, vectors: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Cosine scores of shape (rows, queries), computed block by block"""
+        if self.dtype == "float32":
+            return vectors @ queries.T
+        scale = 1 / 127 if self.dtype == "int8" else 1.0
+        scores = np.empty((len(vectors), len(queries)), dtype=np.float32)
+        for start in range(0, len(vectors), self.SEARCH_BLOCK_ROWS):
+            block = vectors[start:start + self.SEARCH_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        return scores * scale if scale != 1.0 else scores
+
+    def search(self, embeddings, limit):
+        queries = self._normalize(embeddings)
+        with self._lock:
+            count = self._count
+            vectors = self._vectors[:count]
+        if count == 0:
+            return [[] for _ in queries]
+        k = min(limit, count)
+        scores = self._scores(vectors, queries)
+        if k < count:
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        else:
+            top = np.tile(np.arange(count)[:, None], (1, len(queries)))
+        results = []
+        for column in range(len(queries)):
+            rows = top[:, column]
+            rows = rows[np.argsort(-scores[rows, column])]
+            results.append([
+                dict(self._read_document(int(row)), id=int(row), score=float(scores[row, column]))
+                for row in rows
+            ])
+        return results
+
+    def get(self, ids):
+        return {int(doc_id): self._read_document(int(doc_id)) for doc_id in ids if 0 <= doc_id < self._count}
+
+    def iter_documents(self, batch_size=1000):
+        count = self._count
+        for start in range(0, count, batch_size):
+            yield [(row, self._read_document(row)["content"]) for row in range(start, min(start + batch_size, count))]
+
+    def _read_document(self, row: int) -> Dict:
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return json.loads(os.pread(self._docs_file.fileno(), end - start, start))
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def close(self):
+        self.flush()
+        self._docs_file.close()
+
+def create_vector_store(dim: int, backend: str = VECTOR_STORE) -> VectorStore:
+    """Build the vector store selected by VECTOR_STORE"""
+    if backend == "local":
+        return LocalVectorStore(dim)
+    if backend == "milvus":
+        return MilvusVectorStore(dim)
+    raise ValueError(f"Unknown VECTOR_STORE '{backend}' (use 'milvus' or 'local')")